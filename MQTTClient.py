@@ -6,12 +6,25 @@ Created on 18.11.2023
 
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import connack_string as conn_ack
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 import signal
 import logging
 import time
+import asyncio
+import threading
 import socket
 import ssl
 import json
+import random
+import hashlib
+import math
+import os
+import re
+from collections import deque
+from storequeue import StoreQueue, topicKey
+from metrics import REGISTRY, startMetricsServer
+from config import Config, CONFIG_SCHEMA, LOG_LEVEL
 
 """
 QOS: 0 => fire and forget A -> B
@@ -42,34 +55,123 @@ HASS_CONFIG_ICON = "icon"
 HASS_CONFIG_VALUE_TEMPLATE = "value_template"
 HASS_CONFIG_UNIT = "unit_of_measurement"
 HASS_CONFIG_STATECLASS = "state_class"
+HASS_CONFIG_ENTITY_CATEGORY = "entity_category"
 HASS_CONFIG_COMMAND = "command_topic"
 HASS_CONFIG_PAYLOAD_ON = "payload_on"
 HASS_CONFIG_PAYLOAD_OFF = "payload_off"
 
-DEBOUNCE_THRESHOLD = 2
+""" reconnect backoff [s], see MQTTBroker options reconnect_min & reconnect_max """
+RECONNECT_MIN = 1
+RECONNECT_MAX = 300
+
+""" store & forward: default readings per second published after reconnect """
+DRAIN_RATE = 50
+RELOAD_POLL = 1 # [s] max. delay of a config reload requested by SIGHUP
+
+""" publish-on-change: default max. silence [s] of a state topic """
+MAX_SILENCE = 900
+
+""" max. wait [s] for the broker's CONNACK at startup """
+CONNACK_TIMEOUT = 10
+
+""" discovery cache: wait [s] for retained discovery configs after SUBACK """
+DISCOVERY_WINDOW = 0.5
+
+""" option CONFIG_WATCH: config file check interval [s] """
+CONFIG_WATCH_INTERVAL = 2
+
+""" options applied by a config reload, the others require a restart """
+LIVE_OPTIONS = ("LogLevel", "REFRESH_RATE", "MQTTBroker")
+""" broker options requiring a restart """
+TLS_OPTIONS = ("clientkeyfile", "clientcertfile", "servercafile", "protocol")
+
+""" MQTTBroker option protocol: 4 = MQTT v3.1.1 (default), 5 = MQTT v5 """
+MQTT_V5 = 5
+""" MQTT v5: state messages expire after this number of publish intervals """
+STATE_EXPIRY_INTERVALS = 3
+""" MQTT v5 reason codes -> MQTT v3 return codes handled by on_connect/on_disconnect """
+V5_REASON_CODES = {0x82: 2, 0x86: 4, 0x87: 5, 0x88: 3, 0x8B: 7}
+
+PUBLISH_SECONDS = REGISTRY.histogram("mqtt_publish_seconds", "MQTT publish() call latency",
+                                     (1e-5, 1e-4, 1e-3, 1e-2, 0.1))
+PUBLISHES = REGISTRY.counter("mqtt_publishes_total", "MQTT publishes by result code")
+DISCONNECTS = REGISTRY.counter("mqtt_disconnects_total", "unexpected broker disconnects")
+RECONNECTS = REGISTRY.counter("mqtt_reconnects_total", "reconnect attempts by result")
+
+def _jsonValue(obj):
+    """ typed values, e.g. device readings, are serialised by their json() method """
+    if hasattr(obj, "json"):
+        return obj.json()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
 
 def encode_json(value) -> str:
-    return json.dumps(value)
+    return json.dumps(value, default=_jsonValue)
 
 def toStr(bstr:bytes)->str:
     return str(bstr, encoding='utf-8')
 
+class Backoff(object):
+    """
+    jittered exponential backoff: the n-th delay is drawn uniformly
+    from [d/2, d] with d = min(maximum, minimum * 2^n)
+    """
+
+    def __init__(self, minimum=RECONNECT_MIN, maximum=RECONNECT_MAX):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.reset()
+
+    def reset(self):
+        self._attempt = 0
+
+    def next(self) -> float:
+        delay = min(self.maximum, self.minimum * 2 ** self._attempt)
+        self._attempt += 1
+        return random.uniform(delay / 2, delay)
+
 class MQTTClient (mqtt.Client):
     """ MQTT client class with HASS discovery support """
 
     def __init__(self, cfg, ClientID) -> None:
+        self._mqttV5 = MQTT_V5 == cfg.MQTTBroker.get("protocol")
+        protocol = mqtt.MQTTv5 if self._mqttV5 else mqtt.MQTTv311
         if hasattr(mqtt, "CallbackAPIVersion"):
-            super().__init__(mqtt.CallbackAPIVersion.VERSION1,ClientID)
+            super().__init__(mqtt.CallbackAPIVersion.VERSION1,ClientID, protocol=protocol)
         else:
-            super().__init__(ClientID)
+            super().__init__(ClientID, protocol=protocol)
 
         self.cfg = cfg
+        self.cfgFile = None # config file of reloads, set by the creator
+        self._reloadRQ = False
+        self._brokerChanged = False
+        self._startupT0 = time.monotonic()
+        self._startupTimes = dict() # startup stage -> [s] since start
         self._disconnectRQ = False
         self._disconnectCnt = 0
+        self._hassPublished = False
+        self._hassPending = set() # mids of discovery publishes not yet acknowledged
+        self._hassAcked = None # mids acknowledged while discovery configs are published
+        self._hassLock = threading.Lock()
+        self._hassPayloads = dict() # topic -> serialised discovery config
+        self._hassHashes = dict() # topic -> hash of discovery config
+        self._hassCacheFile = cfg.get("DISCOVERY_CACHE", "")
+        self._hassCache = self._loadDiscoveryCache() # discovery topic -> last published hash
+        self._hassCheck = None # running retained discovery check, see _checkDiscovery()
+        self._connAck = threading.Event()
+        self._aliasMax = 0 # MQTT v5: topic aliases accepted by the broker
+        self._aliasTopics = set() # MQTT v5: state & availability topics published by alias
+        self._aliases = dict() # MQTT v5: topic -> topic alias of the connection
+        self._aliasSent = set() # MQTT v5: topic aliases known by the broker
+        self._aliasLock = threading.Lock() # MQTT v5: alias allocation & 1st publish of a topic
+        self._wakeup = threading.Event() # next poll & publish cycle requested
+        self._backoff = Backoff(cfg.MQTTBroker.get("reconnect_min", RECONNECT_MIN),
+                                cfg.MQTTBroker.get("reconnect_max", RECONNECT_MAX))
         self._hostname = self._getHostTopicId()
         self.baseTopic = f"{ClientID}/{self._hostname}"
         signal.signal(signal.SIGINT, self.daemon_kill)
         signal.signal(signal.SIGTERM, self.daemon_kill)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._onSighup)
         self._ONLINE_STATE = f"{self.baseTopic}/online"
 
         self.CLIENT_TOPICS = self.setupClientTopics()
@@ -83,13 +185,60 @@ class MQTTClient (mqtt.Client):
 
         self._avTopics = dict()
         self._stTopics = dict()
+        self._attrTopics = dict()
         self._subTopics = dict()
         self._hassTopics = dict()
+        self._stateKeys = dict() # topic -> JSON key of its value in the state payload
+        self._deadbands = dict() # topic -> (abs, rel) publish-on-change deadband
+        self._lastPublished = dict() # topic -> (last published value, monotonic time)
+        self._storeQueue = None
+        self._queueLock = threading.Lock()
+        self._draining = False
+        self._replayMids = deque() # mids of replayed readings in queue order, None: dropped reading
+        self._replayPending = set() # mids of replayed readings not yet acknowledged
+        self._replayAcks = deque() # mids acknowledged while draining, see on_publish()
+        self._metricsPublished = 0.0
+        metrics = self.cfg.get("METRICS")
+        if metrics:
+            REGISTRY.enable()
+            REGISTRY.gauge("mqtt_queue_depth", "MQTT messages in flight",
+                           lambda: len(getattr(self, "_out_messages", ())))
+            if metrics.get("PORT"):
+                startMetricsServer(metrics.PORT, metrics.get("BIND", "127.0.0.1"))
+        storeForward = self.cfg.get("STORE_FORWARD")
+        if storeForward:
+            self._storeQueue = StoreQueue(storeForward.get("FILE", "./co2queue.bin"),
+                                          storeForward.get("MAX_RECORDS", 100000))
 
         devId=self.setupDevice()
-        if self.poll(): # get 1st values from device
-            self._setupTopics(self.CLIENT_TOPICS,self.SUBSCRIBE_TOPICS)
-            self._setupHassTopics(devId)
+        self._startupMark("device")
+        # topic values are initialised before the 1st poll: the device
+        # waits for all initialised values, e.g. Humidity
+        self._setupTopics(self.CLIENT_TOPICS,self.SUBSCRIBE_TOPICS)
+        self._setupHassTopics(devId)
+        if not self.poll() and not self.pollFailed(): # get 1st values from device
+            logging.error(f"{toStr(self._client_id)}: polling has failed")
+            self.client_down()
+            exit(-2)
+        self._startupMark("first read")
+
+    def _startupMark(self, stage:str):
+        """ record the startup time of stage """
+        if stage not in self._startupTimes:
+            self._startupTimes[stage] = time.monotonic() - self._startupT0
+
+    def _logStartupTimes(self):
+        """ log the startup timing breakdown once """
+        if "logged" in self._startupTimes:
+            return
+        self._startupTimes["logged"] = 0
+        last = 0.0
+        steps = list()
+        for stage, ts in self._startupTimes.items():
+            if stage != "logged":
+                steps.append(f"{stage} {ts - last:.3f}s")
+                last = ts
+        logging.info(f"startup {last:.3f}s: {', '.join(steps)}")
 
     def setupDevice(self):
         """
@@ -128,29 +277,197 @@ class MQTTClient (mqtt.Client):
         """
         pass
 
+    def pollFailed(self) -> bool:
+        """
+        called when poll() has failed,
+        True: the client keeps running, e.g. while the device is recovered,
+        False: client exit (default)
+        may be overwritten by derived class
+        """
+        return False
+
+    def isTopicAvailable(self, tp:str) -> bool:
+        """
+        False: the device of topic tp is not available, its availability
+        is published offline and its states are not published
+        may be overwritten by derived class
+        """
+        return True
+
+    def getRefreshInterval(self) -> float:
+        """
+        get the interval [s] until the next poll & publish cycle,
+        default: REFRESH_RATE
+        may be overwritten by derived class
+        """
+        return self.cfg.REFRESH_RATE
+
+    def wakeup(self):
+        """ start the next poll & publish cycle now """
+        self._wakeup.set()
+        if getattr(self, "_aioLoop", None):
+            self._aioLoop.call_soon_threadsafe(self._aioWakeup.set)
+
+    def isLiveOption(self, option:str, old, new) -> bool:
+        """
+        True: a changed option is applied by a config reload,
+        False: a restart is required
+        may be overwritten by derived class, see applyConfig()
+        """
+        if "MQTTBroker" == option:
+            return all(old.get(k) == new.get(k) for k in TLS_OPTIONS)
+        return option in LIVE_OPTIONS
+
+    def applyConfig(self, options:set):
+        """
+        apply the options changed by a config reload,
+        to be implemented by derived class for its live options
+        """
+        pass
+
+    def requestReload(self, *_args):
+        """ reload the config file in the next client loop """
+        self._reloadRQ = True
+        self.wakeup()
+
+    def _onSighup(self, *_args):
+        """
+        SIGHUP handler: flag the reload only, the interrupted thread may hold
+        the locks of wakeup(), the client loop polls the flag, see _waitCycle()
+        """
+        self._reloadRQ = True
+
+    def _waitCycle(self, interval:float):
+        """ wait for the next cycle: interval [s], wakeup() or a reload request """
+        end = time.monotonic() + interval
+        while not self._reloadRQ:
+            remaining = end - time.monotonic()
+            if remaining <= 0 or self._wakeup.wait(min(remaining, RELOAD_POLL)):
+                break
+
+    def reloadConfig(self) -> bool:
+        """
+        reload & validate the config file, apply the changed live options:
+        log level & refresh rate immediately, broker options by a reconnect.
+        The device and all topic state are kept
+        """
+        self._reloadRQ = False
+        try:
+            cfg = Config.load_json(self.cfgFile)
+        except (OSError, ValueError) as e:
+            logging.error(f"config reload of {self.cfgFile} has failed: {str(e)}")
+            return False
+        errors = CONFIG_SCHEMA.validate(cfg)
+        for error in errors:
+            logging.error(f"config reload of {self.cfgFile}: {error}")
+        if errors:
+            return False
+
+        live = set()
+        new = Config.load_dict(self.cfg)
+        for option in set(self.cfg) | set(cfg):
+            old = self.cfg.get(option)
+            if option.startswith("//") or old == cfg.get(option):
+                continue
+            if not self.isLiveOption(option, old, cfg.get(option)):
+                logging.warning(f"config reload: option {option} has changed, restart required")
+                continue
+            live.add(option)
+            if option in cfg:
+                new[option] = cfg[option]
+            else:
+                del new[option]
+        self.cfg = new
+        if "LogLevel" in live:
+            logging.getLogger().setLevel(LOG_LEVEL[self.cfg.LogLevel])
+        if "MQTTBroker" in live:
+            self._reconnectBroker()
+        self.applyConfig(live)
+        logging.info(f"config reloaded, changed options: {sorted(live)}")
+        return True
+
+    def _reconnectBroker(self):
+        """ controlled reconnect with the reloaded broker options """
+        self._backoff = Backoff(self.cfg.MQTTBroker.get("reconnect_min", RECONNECT_MIN),
+                                self.cfg.MQTTBroker.get("reconnect_max", RECONNECT_MAX))
+        self.username_pw_set(self.cfg.MQTTBroker.username, self.cfg.MQTTBroker.password)
+        if (self.host, self.port) != (self.cfg.MQTTBroker.host, self.cfg.MQTTBroker.port):
+            self._hassPublished = False # new broker: discovery configs unknown
+        if self.is_connected():
+            # host & port are updated before the network loop reconnects
+            self._brokerChanged = True
+            self.disconnect()
+        else:
+            self._updateBrokerAddress()
+
+    def _updateBrokerAddress(self):
+        """ broker host & port of the next (re)connect, connection must be closed """
+        self._brokerChanged = False
+        self.host = self.cfg.MQTTBroker.host
+        self.port = self.cfg.MQTTBroker.port
+        logging.info(f"MQTT Broker {self.host}:{self.port}")
+
+    def _watchConfig(self):
+        """ option CONFIG_WATCH: reload when the config file was modified """
+        mtime = os.stat(self.cfgFile).st_mtime
+        while not self._disconnectRQ:
+            time.sleep(CONFIG_WATCH_INTERVAL)
+            try:
+                current = os.stat(self.cfgFile).st_mtime
+            except OSError:
+                continue
+            if current != mtime:
+                mtime = current
+                logging.info(f"config file {self.cfgFile} has changed")
+                self.requestReload()
+
+    def _startConfigWatch(self):
+        if self.cfgFile and self.cfg.get("CONFIG_WATCH", False):
+            threading.Thread(target=self._watchConfig, name="cfgwatch", daemon=True).start()
+
+    def getTopicAttributes(self, tp:str):
+        """
+        get a dict() of JSON attributes published on the
+        json_attributes_topic of topic tp, None: nothing to publish
+        may be overwritten by derived class
+        """
+        return None
+
+    def getHassDevice(self, tp:str, devId:dict) -> dict:
+        """
+        get the HASS discovery device block of topic tp,
+        default: the single device returned by setupDevice()
+        may be overwritten by derived class serving several devices
+        """
+        return devId
+
     def _setupHassTopics(self, devId:dict):
         """
         setup all topics and HASS discovery configs
         """
         for tp in self.CLIENT_TOPICS:
-            json_attr = f"{self.baseTopic}/{tp}"
+            json_attr = self._attrTopics.get(tp)
             unique_attr = f"{self.baseTopic}/{tp}"
-            name = f"{toStr(self._client_id)}.{self._hostname}.{tp}"
+            name = f"{toStr(self._client_id)}.{self._hostname}.{tp.replace('/', '.')}"
             # generic config attributs
             config_tp = {
-                "device": devId,
+                "device": self.getHassDevice(tp, devId),
                 "availability_topic": self._avTopics[tp],
                 "json_attributes_topic": json_attr,
                 "unique_id": unique_attr,
-                "state_topic": self._stTopics[tp],
+                "state_topic": self._stTopics.get(tp),
+                HASS_CONFIG_COMMAND: self._subTopics.get(tp),
                 "name": name
             }
+            # buttons: command topic only, no state
+            config_tp = {k: v for k, v in config_tp.items() if v is not None}
             # non generic attributs
             if tp in self.HASSCONFIGS:
                 config_tp.update(self.HASSCONFIGS[tp])
 
             self.TopicConfigs[tp] = config_tp
-        self.poll()
+            self._hassPayloads[tp] = encode_json(config_tp).encode('utf-8')
+            self._hassHashes[tp] = hashlib.sha1(self._hassPayloads[tp]).hexdigest()
 
     def _setupTopics(self, topics: dict, subscribeTps:dict):
         """
@@ -166,11 +483,27 @@ class MQTTClient (mqtt.Client):
 
     def _setupTopic(self, tp:str , deviceclass:str, subcmd=None):
         self._avTopics[tp] = f"{self.baseTopic}/{tp}/available"
-        self._stTopics[tp] = f"{self.baseTopic}/{tp}/state"
+        if HASS_COMPONENT_BUTTON != deviceclass: # buttons have no state
+            self._stTopics[tp] = f"{self.baseTopic}/{tp}/state"
+            self._attrTopics[tp] = f"{self.baseTopic}/{tp}"
+        # JSON key used by the value template, default: device class
+        hassConfig = self.HASSCONFIGS.get(tp, dict())
+        key = re.search(r"value_json\.(\w+)", hassConfig.get(HASS_CONFIG_VALUE_TEMPLATE, ""))
+        self._stateKeys[tp] = key.group(1) if key else hassConfig.get(HASS_CONFIG_DEVICE_CLASS, tp)
+        if self.cfg.get("COMBINED_STATE", False) and HASS_COMPONENT_SENSOR == deviceclass:
+            # one state topic per device: <baseTopic>/[<device>/]state
+            group = tp.rpartition("/")[0]
+            self._stTopics[tp] = f"{self.baseTopic}/{group}/state" if group else f"{self.baseTopic}/state"
         # hassTopic pattern :<discovery_prefix>/<component>/[<node_id>/]<object_id>/config
-        self._hassTopics[tp] = f"{HASS_DISCOVERY_PREFIX}/{deviceclass}/{self._hostname}/{tp}/config"
+        # object_id: no further topic levels allowed
+        self._hassTopics[tp] = f"{HASS_DISCOVERY_PREFIX}/{deviceclass}/{self._hostname}/{tp.replace('/', '_')}/config"
         if subcmd:
             self._subTopics[tp] = f"{self.baseTopic}/{tp}/{subcmd}"
+        pubFilter = self.cfg.get("PUBLISH_FILTER")
+        if pubFilter:
+            # deadband configured by topic name, e.g. "CO2" for "<device>/CO2"
+            band = pubFilter.get(tp.split("/")[-1], dict())
+            self._deadbands[tp] = (band.get("ABS", 0), band.get("REL", 0))
 
     def _getHostTopicId(self):
         """
@@ -186,33 +519,404 @@ class MQTTClient (mqtt.Client):
         logging.info(f"{toStr(self._client_id)} MQTT daemon Goodbye!")
         exit(0)
 
-    def on_connect(self, _client, _userdata, _flags, rc):
+    def on_connect(self, _client, _userdata, _flags, rc, properties=None):
         """
         on_connect when MQTT CleanSession=False (default) conn_ack will be send from broker
         """
+        rc = self._v3ReturnCode(rc)
         logging.debug(f"on_connect(): {conn_ack(rc)}")
+        self._startupMark("connack")
         if 0 == rc:
-            self.publish_hass()
-            time.sleep(1)
-            self.publish_avail_topics()
-            time.sleep(1)
-            self.publish(topic=self._ONLINE_STATE, payload=True, qos=0, retain=RETAIN)
-            self.publish_state_topics()
+            self._backoff.reset()
+            if self._mqttV5:
+                self._setupTopicAliases(properties)
+            if self._subTopics:
+                self.subscribe([(topic, QOS) for topic in self._subTopics.values()])
+            if self._hassCacheFile:
+                self._checkDiscovery()
+            else:
+                # reconnect: retained discovery configs are still known by broker
+                if not self._hassPublished:
+                    # states are published when the broker has acknowledged
+                    # all discovery configs, see on_publish()
+                    self._hassPending = self.publish_hass(qos=1)
+                if not self._hassPending:
+                    self._publishOnline()
+        elif rc in (4, 5): # reconnect is pointless
+            logging.error(f"MQTT broker refused connection: {conn_ack(rc)}")
+            self._disconnectRQ = True
+        self._connAck.set()
+
+    @staticmethod
+    def _v3ReturnCode(rc) -> int:
+        """ MQTT v5 reason code of CONNACK/DISCONNECT as MQTT v3 return code """
+        if hasattr(rc, "getName"):
+            if rc.value:
+                logging.info(f"MQTT v5 reason code {rc.value:#x}: {rc.getName()}")
+            return V5_REASON_CODES.get(rc.value, rc.value)
+        return rc
+
+    def _setupTopicAliases(self, properties):
+        """
+        MQTT v5: topic aliases are valid per connection,
+        up to TopicAliasMaximum of the broker's CONNACK
+        """
+        self._aliasMax = getattr(properties, "TopicAliasMaximum", 0) if properties else 0
+        self._aliasTopics = set(self._stTopics.values()) | set(self._avTopics.values())
+        with self._aliasLock:
+            self._aliases = dict()
+            self._aliasSent = set()
+        logging.debug(f"MQTT v5 topic aliases: {self._aliasMax}")
+
+    def _topicAlias(self, topic:str, properties):
+        """
+        MQTT v5: topic & properties of a publish with topic alias,
+        the topic is sent once per connection, then the alias only.
+        The caller holds _aliasLock
+        """
+        alias = self._aliases.get(topic)
+        if alias is None:
+            if len(self._aliases) >= self._aliasMax:
+                return topic, properties, None
+            alias = len(self._aliases) + 1
+            self._aliases[topic] = alias
+        if properties is None:
+            properties = Properties(PacketTypes.PUBLISH)
+        properties.TopicAlias = alias
+        return ("" if alias in self._aliasSent else topic), properties, alias
+
+    def on_publish(self, _client, _userdata, mid):
+        """
+        on_publish: message mid was sent (QOS 0) or acknowledged by broker (QOS 1)
+        """
+        if self._draining:
+            # handled by the drain, no lock: the drain publishes holding _queueLock
+            self._replayAcks.append(mid)
+        with self._hassLock:
+            if self._hassAcked is not None:
+                # PUBACK before publish_hass() has returned the mids, see _publishDiscovery()
+                self._hassAcked.add(mid)
+                return
+            if mid not in self._hassPending:
+                return
+            self._hassPending.discard(mid)
+            done = not self._hassPending
+        if done:
+            self._startupMark("discovery")
+            self._publishOnline()
+
+    def _loadDiscoveryCache(self) -> dict:
+        if self._hassCacheFile and os.path.exists(self._hassCacheFile):
+            try:
+                with open(self._hassCacheFile, "r") as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"discovery cache {self._hassCacheFile} ignored: {str(e)}")
+        return dict()
+
+    def _saveDiscoveryCache(self):
+        self._hassCache.update({self._hassTopics[tp]: h for tp, h in self._hassHashes.items()})
+        tmp = f"{self._hassCacheFile}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._hassCache, f)
+            os.replace(tmp, self._hassCacheFile)
+        except OSError as e:
+            logging.warning(f"discovery cache {self._hassCacheFile} not saved: {str(e)}")
+
+    def _checkDiscovery(self):
+        """
+        option DISCOVERY_CACHE: discovery configs with an unchanged hash
+        are verified by a short subscription to the retained configs,
+        only changed or missing configs are published
+        """
+        cached = [tp for tp, h in self._hassHashes.items()
+                  if self._hassCache.get(self._hassTopics[tp]) == h]
+        if not cached:
+            self._hassCheck = None
+            self._publishDiscovery(list(self._hassHashes))
+            return
+        check = {"topics": [self._hassTopics[tp] for tp in cached],
+                 "retained": dict(), # discovery topic -> hash of retained config
+                 "mid": None}
+        self._hassCheck = check
+        res, check["mid"] = self.subscribe([(topic, 1) for topic in check["topics"]])
+        if res != mqtt.MQTT_ERR_SUCCESS:
+            self._discoveryChecked(check)
+
+    def on_subscribe(self, _client, _userdata, mid, _granted_qos, _properties=None):
+        """ on_subscribe: retained discovery configs follow the SUBACK """
+        check = self._hassCheck
+        if check and check["mid"] == mid:
+            self._callLater(DISCOVERY_WINDOW, self._discoveryChecked, check)
+
+    def _onRetainedDiscovery(self, message) -> bool:
+        """ retained discovery config received, True: message consumed """
+        check = self._hassCheck
+        if not check or message.topic not in check["topics"]:
+            return False
+        if message.retain:
+            check["retained"][message.topic] = hashlib.sha1(message.payload).hexdigest()
+            if len(check["retained"]) == len(check["topics"]):
+                self._discoveryChecked(check)
+        return True
+
+    def _discoveryChecked(self, check:dict):
+        """ end of retained discovery check: publish changed & missing configs """
+        if self._hassCheck is not check:
+            return # finished or outdated check of a previous connection
+        self._hassCheck = None
+        self.unsubscribe(check["topics"])
+        publish = [tp for tp in self._hassHashes
+                   if check["retained"].get(self._hassTopics[tp]) != self._hassHashes[tp]]
+        logging.info(f"discovery configs: {len(self._hassHashes) - len(publish)} unchanged, {len(publish)} published")
+        self._publishDiscovery(publish)
+
+    def _publishDiscovery(self, topics:list):
+        """
+        publish discovery configs, the states follow when the broker has acknowledged all configs.
+        Called by a timer, the network thread may handle a PUBACK before publish_hass() has returned
+        """
+        with self._hassLock:
+            self._hassAcked = set()
+        mids = self.publish_hass(qos=1, topics=topics)
+        with self._hassLock:
+            self._hassPending = mids - self._hassAcked
+            self._hassAcked = None
+            done = not self._hassPending
+        self._saveDiscoveryCache()
+        if done:
+            self._startupMark("discovery")
+            self._publishOnline()
+
+    def _callLater(self, delay:float, func, *args):
+        """ call func after delay [s] in the network loop's runtime """
+        if getattr(self, "_aioLoop", None):
+            self._aioLoop.call_soon_threadsafe(self._aioLoop.call_later, delay, func, *args)
+        else:
+            timer = threading.Timer(delay, func, args)
+            timer.daemon = True
+            timer.start()
+
+    def _publishOnline(self):
+        """
+        publish availability, online & all states after (re)connect
+        """
+        self._hassPublished = True
+        self.publish_avail_topics()
+        self.publish(topic=self._ONLINE_STATE, payload=True, qos=0, retain=RETAIN)
+        self.publish_state_topics(force=True)
+        self._startupMark("online")
+        self._logStartupTimes()
+        self._startDrain()
 
     def publish_avail_topics(self, avail=True):
         """ publish all available topics """
         for t in self._avTopics:
-            self.publish_avail(self._avTopics[t], avail)
+            self.publish_avail(self._avTopics[t], avail and self.isTopicAvailable(t))
+
+    def _isChanged(self, tp:str, value, now:float) -> bool:
+        """
+        publish-on-change filter: True when value left the deadband
+        max(ABS, REL * |last value|) around the last published value
+        or max. silence interval of the topic has expired
+        """
+        band = self._deadbands.get(tp)
+        last = self._lastPublished.get(tp)
+        if band is None or last is None or \
+           now - last[1] >= self.cfg.PUBLISH_FILTER.get("MAX_SILENCE", MAX_SILENCE):
+            return True
+        try:
+            diff = abs(float(value) - float(last[0]))
+            return diff > max(band[0], band[1] * abs(float(last[0])))
+        except (TypeError, ValueError):
+            return value != last[0]
 
-    def publish_state_topics(self):
-        """ publish all state topics """
+    def publish_state_topics(self, force=False):
+        """
+        publish all state topics & their attributes,
+        unchanged values are skipped by the publish-on-change filter unless forced
+        """
+        now = time.monotonic()
+        published = list() # topics with published state
+        states = dict() # state topic -> {state key: value}, several values if combined
+        changed = dict() # state topic -> topics to be published
         for t in self._stTopics:
-            val = self.HASSCONFIGS[t]["device_class"]
-            if HASS_COMPONENT_SWITCH == val:
-                self.publish_state(self._stTopics[t],self.TopicValues[t])
-            else:
-                self.publish_state(self._stTopics[t], encode_json(
-                    {f"{val}": self.TopicValues[t]}))
+            if not self.isTopicAvailable(t):
+                continue
+            if HASS_COMPONENT_SWITCH == self.HASSCONFIGS[t].get(HASS_CONFIG_DEVICE_CLASS):
+                if force or self._isChanged(t, self.TopicValues[t], now):
+                    self._lastPublished[t] = (self.TopicValues[t], now)
+                    self.publish_state(self._stTopics[t],self.TopicValues[t])
+                    published.append(t)
+                continue
+            states.setdefault(self._stTopics[t], dict())[self._stateKeys[t]] = self.TopicValues[t]
+            if force or self._isChanged(t, self.TopicValues[t], now):
+                changed.setdefault(self._stTopics[t], list())
+        # a combined state topic is published if any of its values has changed
+        for t in self._stTopics:
+            if self._stTopics[t] in changed:
+                changed[self._stTopics[t]].append(t)
+        for topic, tps in changed.items():
+            for t in tps:
+                self._lastPublished[t] = (self.TopicValues[t], now)
+            sampleTime = self._sampleTime(self.TopicValues[t] for t in tps) if self._mqttV5 else None
+            self.publish_state(topic, encode_json(states[topic]), sampleTime)
+            published.extend(tps)
+        self.publish_attribute_topics(published)
+
+    def publish_attribute_topics(self, topics=None):
+        """
+        publish JSON attributes of all topics or the given topics providing some,
+        the attributes of a topic are published along with its state
+        """
+        for t in self._attrTopics if topics is None else topics:
+            if t not in self._attrTopics:
+                continue
+            attr = self.getTopicAttributes(t)
+            if attr is not None:
+                self.publish_state(self._attrTopics[t], encode_json(attr))
+
+    def publish_cycle(self):
+        """
+        publish all state topics or store the readings
+        while the broker is not connected
+        """
+        if self.is_connected():
+            self.publish_state_topics()
+            self.publish_metrics()
+        elif self._storeQueue is not None:
+            self.store_state_topics()
+
+    def publish_metrics(self):
+        """ publish metrics snapshot on <baseTopic>/metrics if due """
+        metrics = self.cfg.get("METRICS")
+        if metrics and metrics.get("TOPIC_INTERVAL"):
+            now = time.monotonic()
+            if now - self._metricsPublished >= metrics.TOPIC_INTERVAL:
+                self._metricsPublished = now
+                self.publish(f"{self.baseTopic}/metrics", encode_json(REGISTRY.snapshot()), qos=QOS)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        """
+        paho publish() with latency & result metrics,
+        MQTT v5: state & availability topics by topic alias (QOS 0 only)
+        """
+        if self._aliasMax and 0 == qos and topic in self._aliasTopics:
+            # allocation, publish & registration of an alias must not interleave between threads,
+            # else an alias only publish may overtake the publish with topic
+            with self._aliasLock:
+                topic, properties, alias = self._topicAlias(topic, properties)
+                info = self._publish(topic, payload, qos, retain, properties)
+                if alias and mqtt.MQTT_ERR_SUCCESS == info.rc:
+                    self._aliasSent.add(alias)
+            return info
+        return self._publish(topic, payload, qos, retain, properties)
+
+    def _publish(self, topic, payload, qos, retain, properties):
+        if not REGISTRY.enabled:
+            return super().publish(topic, payload, qos, retain, properties)
+        start = time.perf_counter()
+        info = super().publish(topic, payload, qos, retain, properties)
+        PUBLISH_SECONDS.observe(time.perf_counter() - start)
+        PUBLISHES.inc(rc=int(info.rc))
+        return info
+
+    def store_state_topics(self):
+        """ append all numeric state values to the store & forward queue """
+        now = time.time()
+        with self._queueLock:
+            for t in self._stTopics:
+                if not self.isTopicAvailable(t):
+                    continue
+                try:
+                    value = float(self.TopicValues[t])
+                except (TypeError, ValueError):
+                    continue
+                if not self._storeQueue.append(now, t, value):
+                    logging.warning("store queue is full, reading dropped")
+                    break
+            self._storeQueue.flush()
+        logging.debug(f"stored readings while disconnected: {len(self._storeQueue)}")
+
+    def _drainStoreQueue(self, num:int) -> int:
+        """
+        publish stored readings with QOS 1 on the replay topics <baseTopic>/<topic>/replay,
+        max. num readings in flight. Readings are removed from the queue when the broker
+        has acknowledged them and all older readings, returns number of removed readings
+        """
+        topics = {topicKey(t): t for t in self._stTopics}
+        with self._queueLock:
+            if self._storeQueue is None: # closed by client_down()
+                return 0
+            done = self._consumeReplayed()
+            inFlight = len(self._replayMids)
+            for ts, key, value in self._storeQueue.peek(num - inFlight, inFlight):
+                tp = topics.get(key)
+                mid = None
+                if tp: # readings of removed topics are dropped
+                    payload = encode_json({self._stateKeys[tp]: value,
+                                           "timestamp": round(ts, 3)})
+                    info = self.publish(f"{self.baseTopic}/{tp}/replay", payload, qos=1)
+                    if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                        break
+                    mid = info.mid
+                    self._replayPending.add(mid)
+                self._replayMids.append(mid)
+        return done
+
+    def _consumeReplayed(self) -> int:
+        """ remove the acknowledged replayed readings from the queue, the caller holds _queueLock """
+        while self._replayAcks:
+            self._replayPending.discard(self._replayAcks.popleft())
+        done = 0
+        while self._replayMids and self._replayMids[0] not in self._replayPending:
+            self._replayMids.popleft()
+            done += 1
+        self._storeQueue.consume(done)
+        return done
+
+    def _endDrain(self):
+        """
+        end of drain: unacknowledged readings stay in the queue
+        and are published again by the next drain
+        """
+        with self._queueLock:
+            self._replayMids.clear()
+            self._replayPending.clear()
+            self._replayAcks.clear()
+        self._draining = False
+
+    def _startDrain(self):
+        """
+        drain the store & forward queue at a bounded rate after (re)connect
+        """
+        if self._draining or not self._pendingReadings():
+            return
+        self._draining = True
+        logging.info(f"forwarding {self._pendingReadings()} stored readings")
+        if getattr(self, "_aioLoop", None):
+            self._aioLoop.create_task(self._aio_drain())
+        else:
+            threading.Thread(target=self._drain, name="drain", daemon=True).start()
+
+    def _pendingReadings(self) -> int:
+        with self._queueLock:
+            return len(self._storeQueue) if self._storeQueue is not None else 0
+
+    def _drain(self):
+        rate = self.cfg.STORE_FORWARD.get("DRAIN_RATE", DRAIN_RATE)
+        while self.is_connected() and self._pendingReadings():
+            self._drainStoreQueue(rate)
+            time.sleep(1)
+        self._endDrain()
+
+    async def _aio_drain(self):
+        rate = self.cfg.STORE_FORWARD.get("DRAIN_RATE", DRAIN_RATE)
+        while self.is_connected() and self._pendingReadings():
+            self._drainStoreQueue(rate)
+            await asyncio.sleep(1)
+        self._endDrain()
 
     def on_message(self, _client, _userdata, message):
         """
@@ -220,22 +924,39 @@ class MQTTClient (mqtt.Client):
         """
         logging.debug(
             f" Received message  {str(message.payload) } on topic {message.topic} with QoS {str(message.qos)}")
+        if self._onRetainedDiscovery(message):
+            return
         payload = str(message.payload.decode("utf-8"))
+        for tp, topic in self._subTopics.items():
+            if topic == message.topic:
+                if message.retain: # stale command, e.g. published with retain flag
+                    logging.warning(f"Ignoring retained command topic {message.topic}:{payload}")
+                else:
+                    self.onCommand(tp, payload)
+                return
         logging.warning(f"Ignoring message topic {message.topic}:{payload}")
 
-    def on_disconnect(self, _client, _userdata, rc=0):
+    def onCommand(self, tp:str, payload:str):
+        """
+        command received on the subscribed topic of tp,
+        called by the network loop: long running commands must be deferred
+        to be implemented by derived class
+        """
+        logging.warning(f"Ignoring command {tp}:{payload}")
+
+    def on_disconnect(self, _client, _userdata, rc=0, _properties=None):
         """
         on_disconnect by external event
         """
+        rc = self._v3ReturnCode(rc)
+        self._aliasMax = 0
         if rc > 0 and not self._disconnectRQ:
             logging.error(f"MQTT broker was disconnected: errorcode={rc} ")
             match rc:
                 case 16:
                     logging.error("- by router , WIFI access point channel has changed?")
-                    self._disconnectCnt+=1
                 case 7:
                     logging.error("- broker down ?")
-                    self._disconnectCnt+=1
                 case 5:
                     logging.error ("- not authorised")
                     self._disconnectRQ = True
@@ -244,16 +965,13 @@ class MQTTClient (mqtt.Client):
                     self._disconnectRQ = True
                 case _:
                     logging.error ("unknown reason")
-                    self.loop_stop()
-                    self._disconnectRQ = True
-            if self._disconnectCnt>=DEBOUNCE_THRESHOLD:
-                    logging.info (f"disconnect debounce cnt = {self._disconnectCnt} ")
-                    logging.error ("connction broken - exit")
-                    self.loop_stop()
-                    self._disconnectRQ = True
+            if not self._disconnectRQ:
+                # device & topic state is kept, network loop reconnects
+                DISCONNECTS.inc()
+                self._disconnectCnt+=1
+                logging.info (f"reconnecting - disconnect cnt = {self._disconnectCnt} ")
         else:
             logging.debug("client disconnected: " + str(rc))
-            self.loop_stop()
 
     def client_down(self):
         """
@@ -264,7 +982,11 @@ class MQTTClient (mqtt.Client):
         self.publish_avail_topics(avail=False)
         self.publish(self._ONLINE_STATE, False, RETAIN)
         self.disconnect()
-        self.loop_stop()
+        with self._queueLock:
+            if self._storeQueue is not None:
+                self._consumeReplayed()
+                self._storeQueue.close()
+                self._storeQueue = None
 
     def publish_avail(self, topic, avail=True):
         """ publish available topic """
@@ -274,14 +996,44 @@ class MQTTClient (mqtt.Client):
         self.publish(topic=topic, payload=payload, qos=0, retain=RETAIN)
         logging.debug(f"publish avail:{str(topic)}:{payload}")
 
-    def publish_state(self, topic, payload):
-        """ publish state topic """
-        self.publish(topic=topic, payload=payload, retain=RETAIN)
+    def publish_state(self, topic, payload, sampleTime=None):
+        """
+        publish state topic,
+        MQTT v5: with message expiry & sample time [s since epoch] as user property ts
+        """
+        properties = None
+        if self._mqttV5:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.MessageExpiryInterval = self._stateExpiry()
+            if sampleTime:
+                ms = int(sampleTime * 1000) % 1000
+                properties.UserProperty = ("ts", time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sampleTime)) + f".{ms:03d}Z")
+        self.publish(topic=topic, payload=payload, retain=RETAIN, properties=properties)
         logging.debug(f"publish state:{str(topic)}:{payload}")
 
-    def publish_hass(self):
+    def _stateExpiry(self) -> int:
+        """
+        MQTT v5 message expiry [s] of states: STATE_EXPIRY_INTERVALS publish intervals,
+        unchanged values are republished after max. silence by the publish-on-change filter
+        """
+        interval = self.getRefreshInterval()
+        pubFilter = self.cfg.get("PUBLISH_FILTER")
+        if pubFilter:
+            interval = max(interval, pubFilter.get("MAX_SILENCE", MAX_SILENCE))
+        return max(1, math.ceil(STATE_EXPIRY_INTERVALS * interval))
+
+    @staticmethod
+    def _sampleTime(values):
+        """ time [s since epoch] of the newest value with monotonic timestamp ts, e.g. a device reading """
+        ts = [v.ts for v in values if hasattr(v, "ts")]
+        if not ts:
+            return None
+        return time.time() - (time.monotonic() - max(ts))
+
+    def publish_hass(self, qos=0, topics=None) -> set:
         """ 
-        publish all homeassistant discovery topics
+        publish all homeassistant discovery topics or the given topics,
+        returns the mids of the published messages
         """
 
         """
@@ -295,11 +1047,40 @@ class MQTTClient (mqtt.Client):
     
         """
         logging.debug("publishing HASS discoveries")
-        for cfg in self.TopicConfigs:
-            payload = encode_json(self.TopicConfigs[cfg])
+        mids = set()
+        for cfg in self.TopicConfigs if topics is None else topics:
+            payload = self._hassPayloads[cfg]
             topic = self._hassTopics[cfg]
             logging.debug(f"publish hass:{str(topic)}:{payload}")
-            self.publish(topic, payload=payload, retain=True)
+            info = self.publish(topic, payload=payload, qos=qos, retain=True)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                mids.add(info.mid)
+        return mids
+
+    def _setupCredentials(self):
+        """
+        set broker credentials & TLS client certificate if configured
+        """
+        self.username_pw_set(
+            self.cfg.MQTTBroker.username,
+            self.cfg.MQTTBroker.password)
+        # client certificate needed ?
+        if len(self.cfg.MQTTBroker.clientcertfile) and \
+           len(self.cfg.MQTTBroker.clientkeyfile):
+            self.tls_set(certfile=self.cfg.MQTTBroker.clientcertfile,
+                         keyfile=self.cfg.MQTTBroker.clientkeyfile,
+                         cert_reqs=ssl.CERT_REQUIRED)
+
+    @staticmethod
+    def _connectErrorMsg(res) -> str:
+        match res:
+            case 1: msg = "incorrect protocol version"
+            case 2: msg = "invalid client identifier"
+            case 3: msg = "server not available"
+            case 4: msg = "wrong username or password"
+            case 5: msg = "not authorised"
+            case _:msg = "unknown reason"
+        return msg
 
     def startup_client(self):
         """
@@ -307,32 +1088,30 @@ class MQTTClient (mqtt.Client):
         """
         logging.info(f'Starting up MQTT Service {toStr(self._client_id)}')
         try:
-            self.username_pw_set(
-                self.cfg.MQTTBroker.username,
-                self.cfg.MQTTBroker.password)
-            # client certificate needed ?
-            if len(self.cfg.MQTTBroker.clientcertfile) and \
-               len(self.cfg.MQTTBroker.clientkeyfile):
-                self.tls_set(certfile=self.cfg.MQTTBroker.clientcertfile,
-                             keyfile=self.cfg.MQTTBroker.clientkeyfile,
-                             cert_reqs=ssl.CERT_REQUIRED)
-            res=self.connect(self.cfg.MQTTBroker.host,self.cfg.MQTTBroker.port)
+            self._setupCredentials()
+            while True:
+                try:
+                    res=self.connect(self.cfg.MQTTBroker.host,self.cfg.MQTTBroker.port)
+                    self._startupMark("connect")
+                    break
+                except OSError as e: # broker not reachable (yet)
+                    delay = self._backoff.next()
+                    logging.error(
+                        f"{str(e)}: connection to MQTT Broker {self.cfg.MQTTBroker.host} has failed, retry in {delay:.1f}s")
+                    time.sleep(delay)
             logging.debug(f"MQTT host connection result: {res}")
             if res>0:
-                match res:
-                    case 1: msg = "incorrect protocol version"
-                    case 2: msg = "invalid client identifier"
-                    case 3: msg = "server not available"
-                    case 4: msg = "wrong username or password"
-                    case 5: msg = "not authorised"
-                    case _:msg = "unknown reason"
-                logging.error(f"Broker connection failed due to {msg} and exit() ")
+                logging.error(f"Broker connection failed due to {self._connectErrorMsg(res)} and exit() ")
                 exit (-1)
-            self.loop_start()
-            time.sleep(3)
+            threading.Thread(target=self._networkLoop, name="mqtt", daemon=True).start()
+            self._startConfigWatch()
+            if not self._connAck.wait(CONNACK_TIMEOUT):
+                logging.warning(f"no CONNACK of MQTT Broker {self.cfg.MQTTBroker.host} within {CONNACK_TIMEOUT}s")
             if self._disconnectRQ: #due to on_connect with error
                 #logging.info(f"{self._client_id} MQTT Goodbye!")
                 exit(-2)
+        except SystemExit:
+            raise
         except BaseException as e:
             logging.error(
                     f"{str(e)}: connection to MQTT Broker {self.cfg.MQTTBroker.host} has failed & exit ()")
@@ -342,14 +1121,18 @@ class MQTTClient (mqtt.Client):
         while True:
             logging.debug(f"{toStr(self._client_id)}-Loop")
             try:
-                time.sleep(self.cfg.REFRESH_RATE)
+                self._waitCycle(self.getRefreshInterval())
+                self._wakeup.clear()
+                if self._reloadRQ:
+                    self.reloadConfig()
+                    continue
                 if self._disconnectRQ:
                     logging.info(f"{toStr(self._client_id)} MQTT Goodbye!")
                     exit(0)
                 else:
                     if self.poll():
-                        self.publish_state_topics()
-                    else:
+                        self.publish_cycle()
+                    elif not self.pollFailed():
                         logging.error(f"{toStr(self._client_id)}: polling has failed")
                         self.client_down()
                         exit(-2)
@@ -360,7 +1143,170 @@ class MQTTClient (mqtt.Client):
 
             except Exception as e:
                 logging.error(f"{toStr(self._client_id)} exception:{str(e)}")
+                self._disconnectRQ = True
                 self.disconnect()
-                self.loop_stop()
                 exit(-1)
 
+    def _networkLoop(self):
+        """
+        MQTT network loop with in-process reconnect:
+        jittered exponential backoff, device & topic state is kept
+        """
+        while not self._disconnectRQ:
+            rc = self.loop(timeout=1.0)
+            if rc != mqtt.MQTT_ERR_SUCCESS and not self._disconnectRQ:
+                delay = self._backoff.next()
+                logging.info(f"reconnect to MQTT Broker {self.cfg.MQTTBroker.host} in {delay:.1f}s")
+                time.sleep(delay)
+                try:
+                    if self._brokerChanged:
+                        self._updateBrokerAddress()
+                    self.reconnect()
+                    RECONNECTS.inc(result="ok")
+                except OSError as e:
+                    RECONNECTS.inc(result="failed")
+                    logging.error(f"{str(e)}: reconnect to MQTT Broker has failed")
+        logging.debug("MQTT network loop stopped")
+
+
+    def startup_client_async(self):
+        """
+        Start the MQTT client in asyncio runtime mode:
+        MQTT network I/O, periodic polls & publishes, reconnects and signal
+        handling are scheduled as tasks on one event loop,
+        device polls are offloaded to an executor
+        """
+        logging.info(f'Starting up MQTT Service {toStr(self._client_id)} (asyncio)')
+        self._exitCode = 0
+        try:
+            asyncio.run(self._async_main())
+        except Exception as e:
+            logging.error(f"{toStr(self._client_id)} exception:{str(e)}")
+            self._exitCode = -1
+        logging.info(f"{toStr(self._client_id)} MQTT Goodbye!")
+        exit(self._exitCode)
+
+    async def _async_main(self):
+        loop = asyncio.get_running_loop()
+        self._aioLoop = loop
+        self._aioStop = asyncio.Event()
+        self._aioSockClosed = asyncio.Event()
+        self._aioWakeup = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._aioStop.set)
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, self.requestReload)
+
+        self._aioThread = threading.get_ident()
+        self.on_socket_open = lambda _c, _u, sock: self._aio_call(self._aio_socket_open, sock)
+        self.on_socket_close = lambda _c, _u, sock: self._aio_call(self._aio_socket_close, sock)
+        self.on_socket_register_write = lambda _c, _u, sock: self._aio_call(loop.add_writer, sock, self.loop_write)
+        self.on_socket_unregister_write = lambda _c, _u, sock: self._aio_call(loop.remove_writer, sock)
+
+        self._setupCredentials()
+        while True:
+            try:
+                res = await loop.run_in_executor(None, self.connect,
+                                                 self.cfg.MQTTBroker.host, self.cfg.MQTTBroker.port)
+                break
+            except OSError as e: # broker not reachable (yet)
+                delay = self._backoff.next()
+                logging.error(
+                    f"{str(e)}: connection to MQTT Broker {self.cfg.MQTTBroker.host} has failed, retry in {delay:.1f}s")
+                try:
+                    await asyncio.wait_for(self._aioStop.wait(), delay)
+                except asyncio.TimeoutError:
+                    continue
+                self._disconnectRQ = True
+                self.client_down()
+                return
+        self._startupMark("connect")
+        logging.debug(f"MQTT host connection result: {res}")
+        if res > 0:
+            logging.error(f"Broker connection failed due to {self._connectErrorMsg(res)}")
+            self._exitCode = -1
+            return
+
+        self._startConfigWatch()
+        tasks = [asyncio.create_task(self._aio_misc()),
+                 asyncio.create_task(self._aio_poll()),
+                 asyncio.create_task(self._aio_reconnect())]
+        await self._aioStop.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.is_connected():
+            self.client_down()
+            try:
+                await asyncio.wait_for(self._aioSockClosed.wait(), 1)
+            except asyncio.TimeoutError:
+                logging.debug("socket close timeout")
+        else:
+            self._disconnectRQ = True
+            self.client_down()
+
+    def _aio_call(self, func, *args):
+        """
+        paho socket callbacks are called by the event loop or by
+        executor threads (connect/reconnect)
+        """
+        if threading.get_ident() == self._aioThread:
+            func(*args)
+        else:
+            self._aioLoop.call_soon_threadsafe(func, *args)
+
+    def _aio_socket_open(self, sock):
+        self._aioSockClosed.clear()
+        self._aioLoop.add_reader(sock, self.loop_read)
+
+    def _aio_socket_close(self, sock):
+        self._aioLoop.remove_reader(sock)
+        self._aioLoop.remove_writer(sock)
+        self._aioSockClosed.set()
+
+    async def _aio_misc(self):
+        """ MQTT keep alive & retry handling """
+        while True:
+            self.loop_misc()
+            await asyncio.sleep(1)
+
+    async def _aio_poll(self):
+        """ periodic device poll & state publish """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._aioWakeup.wait(), self.getRefreshInterval())
+            except asyncio.TimeoutError:
+                pass
+            self._aioWakeup.clear()
+            if self._reloadRQ:
+                self.reloadConfig()
+                continue
+            logging.debug(f"{toStr(self._client_id)}-Loop")
+            if await loop.run_in_executor(None, self.poll):
+                self.publish_cycle()
+            elif not self.pollFailed():
+                logging.error(f"{toStr(self._client_id)}: polling has failed")
+                self._exitCode = -2
+                self._aioStop.set()
+                return
+
+    async def _aio_reconnect(self):
+        """ reconnect to broker when the connection was lost """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._aioSockClosed.wait()
+            if self._disconnectRQ:
+                self._aioStop.set()
+                return
+            delay = self._backoff.next()
+            logging.info(f"reconnect to MQTT Broker {self.cfg.MQTTBroker.host} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            try:
+                if self._brokerChanged:
+                    self._updateBrokerAddress()
+                await loop.run_in_executor(None, self.reconnect)
+                RECONNECTS.inc(result="ok")
+            except OSError as e:
+                RECONNECTS.inc(result="failed")
+                logging.error(f"{str(e)}: reconnect to MQTT Broker has failed")
@@ -0,0 +1,134 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+import json
+import threading
+import zlib
+from collections import deque
+
+""" 1st byte of a zlib stream, a JSON batch starts with '{' """
+ZLIB_HEADER = 0x78
+
+
+def encodeBatch(samples: list, compress: bool = False, seq: int = 0) -> bytes:
+    """
+    batch payload of time ordered samples (timestamp [s since epoch], value):
+    {"seq": <batch sequence>, "t0": <1st timestamp>, "dt": [<ms since t0>, ...], "v": [<value>, ...]},
+    optionally zlib compressed
+    """
+    t0 = round(samples[0][0], 3) if len(samples) else 0
+    payload = json.dumps({"seq": seq,
+                          "t0": t0,
+                          "dt": [round((ts - t0) * 1000) for ts, _v in samples],
+                          "v": [v for _ts, v in samples]},
+                         separators=(",", ":")).encode("utf-8")
+    return zlib.compress(payload, 9) if compress else payload
+
+
+def decodeBatch(payload: bytes) -> tuple:
+    """
+    batch sequence & samples (timestamp [s since epoch], value) of a plain or zlib
+    compressed batch payload, an invalid payload raises ValueError, KeyError, TypeError or zlib.error
+    """
+    if payload[:1] == bytes((ZLIB_HEADER,)):
+        payload = zlib.decompress(payload)
+    batch = json.loads(payload)
+    t0 = batch["t0"]
+    return batch.get("seq"), _checkSamples([(t0 + dt / 1000, v) for dt, v in zip(batch["dt"], batch["v"])])
+
+
+def decodeReplay(payload: bytes) -> tuple:
+    """
+    no sequence & the sample (timestamp [s since epoch], value) of a store & forward
+    replay payload {<state key>: <value>, "timestamp": <timestamp>} as list, an invalid
+    payload raises ValueError, KeyError or TypeError
+    """
+    reading = json.loads(payload)
+    if not isinstance(reading, dict):
+        raise TypeError(f"invalid reading {reading!r}")
+    ts = reading.pop("timestamp")
+    if len(reading) != 1:
+        raise ValueError(f"invalid reading {reading!r}")
+    return None, _checkSamples([(ts, *reading.values())])
+
+
+def _checkSamples(samples: list) -> list:
+    for ts, v in samples:
+        for x in (ts, v):
+            if isinstance(x, bool) or not isinstance(x, (int, float)):
+                raise ValueError(f"invalid value {x!r}")
+    return samples
+
+
+class BackfillBuffer(object):
+    """
+    samples of all topics since the last batch publish, bounded by
+    maxRecords: the oldest samples are dropped when the buffer is full
+    """
+
+    def __init__(self, maxRecords: int = 100000):
+        self.maxRecords = maxRecords
+        self._samples = dict() # topic -> deque of (timestamp, value)
+        self._size = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def append(self, topic: str, ts: float, value):
+        with self._lock:
+            if self._size >= self.maxRecords:
+                # drop the oldest sample of the longest topic
+                longest = max(self._samples.values(), key=len)
+                longest.popleft()
+                self._size -= 1
+                self._dropped += 1
+            self._samples.setdefault(topic, deque()).append((ts, value))
+            self._size += 1
+
+    def take(self) -> dict:
+        """ all buffered samples per topic, the buffer is empty afterwards """
+        with self._lock:
+            samples = self._samples
+            self._samples = dict()
+            self._size = 0
+            return samples
+
+    def dropped(self) -> int:
+        """ number of dropped samples since the last call """
+        with self._lock:
+            dropped = self._dropped
+            self._dropped = 0
+            return dropped
+
+
+class StatisticsTable(object):
+    """
+    consumer side: statistics rows of backfill batches per statistic id
+    and period [s], like the hourly long-term statistics of Home Assistant
+    """
+
+    def __init__(self, period: int = 3600):
+        self.period = period
+        self._stats = dict() # (statistic id, period start) -> [sum, min, max, count]
+
+    def add(self, statisticId: str, samples: list):
+        for ts, value in samples:
+            start = int(ts - ts % self.period)
+            stat = self._stats.get((statisticId, start))
+            if stat is None:
+                self._stats[(statisticId, start)] = [value, value, value, 1]
+            else:
+                stat[0] += value
+                stat[1] = min(stat[1], value)
+                stat[2] = max(stat[2], value)
+                stat[3] += 1
+
+    def rows(self) -> list:
+        """ rows (statistic id, period start [s since epoch], mean, min, max, count) ordered by id & start """
+        return [(sid, start, stat[0] / stat[3], stat[1], stat[2], stat[3])
+                for (sid, start), stat in sorted(self._stats.items())]
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# encoding: utf-8
+'''
+CO2MqttSensor backfill importer
+
+subscribes the backfill batches (option BACKFILL) and the forwarded readings
+(option STORE_FORWARD) of CO2MqttSensor clients and turns them into statistics rows: mean, min & max per sensor and period
+
+@author:     irimi@gmx.de
+
+@license:    GNU GENERAL PUBLIC LICENSE Version 3
+'''
+
+import sys
+import os
+import json
+import time
+import logging
+import zlib
+from datetime import datetime, timezone
+
+from optparse import OptionParser
+
+import paho.mqtt.client as mqtt
+from backfill import StatisticsTable, decodeBatch, decodeReplay
+from config import Config
+
+BACKFILL_SUFFIX = "/backfill"
+REPLAY_SUFFIX = "/replay"
+
+
+def writeRows(rows: list, out, fmt: str = "csv"):
+    """ write statistics rows as CSV or JSON array of row objects """
+    if "json" == fmt:
+        json.dump([{"statistic_id": sid,
+                    "start": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+                    "mean": round(mean, 3), "min": low, "max": high, "count": count}
+                   for sid, start, mean, low, high, count in rows], out, indent=1)
+        out.write("\n")
+        return
+    out.write("statistic_id,start,mean,min,max,count\n")
+    for sid, start, mean, low, high, count in rows:
+        ts = datetime.fromtimestamp(start, timezone.utc).isoformat()
+        out.write(f"{sid},{ts},{round(mean, 3)},{low},{high},{count}\n")
+
+
+def save(table: StatisticsTable, output: str, fmt: str):
+    """ rewrite the output file with all rows, the rows of a period are complete after its batches """
+    if not output:
+        return
+    tmp = output + ".tmp"
+    with open(tmp, "w") as out:
+        writeRows(table.rows(), out, fmt)
+    os.replace(tmp, output)
+
+
+def main(argv=None):
+    '''Command line options.'''
+
+    parser = OptionParser(usage="%prog [options]",
+                          description="import the backfill batches & forwarded readings of CO2MqttSensor as statistics rows")
+    parser.add_option("-c", "--cfg", dest="cfgfile", metavar="FILE",
+                      help="config file of the MQTT broker [default: %default]")
+    parser.add_option("--host", dest="host", help="MQTT broker, overrides the config file")
+    parser.add_option("--port", dest="port", type="int", help="MQTT broker port, overrides the config file")
+    parser.add_option("--topic", dest="topic", default="co2sensor/#",
+                      help="subscribed topic filter [default: %default]")
+    parser.add_option("--period", dest="period", type="int", default=3600,
+                      help="statistics period [s] [default: %default]")
+    parser.add_option("--duration", dest="duration", type="float", default=0,
+                      help="stop after DURATION [s], 0: until ctrl-c [default: %default]")
+    parser.add_option("--format", dest="fmt", type="choice", choices=["csv", "json"], default="csv",
+                      help="csv or json [default: %default]")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE",
+                      help="output file, rewritten after each batch [default: stdout at exit]")
+    parser.set_defaults(cfgfile="./config.json")
+    (opts, _args) = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%H:%M:%S')
+
+    broker = dict()
+    if os.path.exists(opts.cfgfile):
+        broker = Config.load_json(opts.cfgfile).get("MQTTBroker") or dict()
+    host = opts.host or broker.get("host", "localhost")
+    port = opts.port or broker.get("port", 1883)
+
+    table = StatisticsTable(opts.period)
+    imported = set() # (topic, start timestamp, sequence) of imported batches & readings
+
+    def on_connect(client, _userdata, _flags, rc):
+        if 0 == rc:
+            client.subscribe(opts.topic, 1)
+        else:
+            logging.error(f"MQTT broker {host}: {mqtt.connack_string(rc)}")
+
+    def on_message(_client, _userdata, message):
+        if message.topic.endswith(BACKFILL_SUFFIX):
+            suffix, decode = BACKFILL_SUFFIX, decodeBatch
+        elif message.topic.endswith(REPLAY_SUFFIX):
+            suffix, decode = REPLAY_SUFFIX, decodeReplay
+        else:
+            return
+        try:
+            seq, samples = decode(message.payload)
+        except (ValueError, KeyError, TypeError, zlib.error) as e:
+            logging.error(f"invalid {suffix[1:]} payload on {message.topic}: {str(e)}")
+            return
+        if not samples:
+            return
+        # QOS 1: the broker may deliver a batch again, e.g. after a reconnect
+        key = (message.topic, samples[0][0], seq)
+        if key in imported:
+            logging.info(f"{message.topic}: duplicate {suffix[1:]} dropped")
+            return
+        imported.add(key)
+        table.add(message.topic[:-len(suffix)], samples)
+        logging.info(f"{message.topic}: {len(samples)} readings")
+        save(table, opts.output, opts.fmt)
+
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, f"co2backfill-{os.getpid()}")
+    else:
+        client = mqtt.Client(f"co2backfill-{os.getpid()}")
+    if broker.get("username"):
+        client.username_pw_set(broker.username, broker.get("password"))
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(host, port)
+    client.loop_start()
+    try:
+        if opts.duration > 0:
+            time.sleep(opts.duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    if not opts.output:
+        writeRows(table.rows(), sys.stdout, opts.fmt)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+# encoding: utf-8
+'''
+CO2MqttSensor benchmark suite
+
+measures the hot paths without hardware & broker:
+decrypt/to16bit decode rate, receive()/poll latency with simulated devices
+and publish rate against an in-process MQTT broker stand-in
+
+@author:     irimi@gmx.de
+
+@license:    GNU GENERAL PUBLIC LICENSE Version 3
+'''
+
+import sys
+import os
+import json
+import time
+import socket
+import logging
+import platform
+import threading
+
+from optparse import OptionParser
+
+import co2device
+from co2device import CO2Device, Decryptor, decrypt, to16bit, getRandom
+from hidtransport import SimulatedTransport
+from config import Config
+
+VENDOR = 0x04d9
+PRODUCT = 0xa052
+""" benchmark result is a regression when it's slower by this fraction """
+REGRESSION_THRESHOLD = 0.2
+
+
+class BrokerStandIn(object):
+    """
+    in-process MQTT 3.1.1 broker stand-in: acknowledges CONNECT, SUBSCRIBE,
+    PINGREQ and QoS 1 PUBLISH packets and counts all received publishes
+    """
+
+    def __init__(self):
+        self._srv = socket.socket()
+        self._srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._srv.bind(("127.0.0.1", 0))
+        self._srv.listen(4)
+        self.port = self._srv.getsockname()[1]
+        self.publishes = 0
+        self.bytes = 0
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._srv.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _addr = self._srv.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _recv(conn, size) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _serve(self, conn):
+        try:
+            while True:
+                header = self._recv(conn, 1)[0]
+                size, mult = 0, 1
+                while True:
+                    b = self._recv(conn, 1)[0]
+                    size += (b & 0x7f) * mult
+                    mult *= 128
+                    if not b & 0x80:
+                        break
+                body = self._recv(conn, size)
+                match header >> 4:
+                    case 1: # CONNECT
+                        conn.sendall(bytes([0x20, 2, 0, 0]))
+                    case 3: # PUBLISH
+                        self.publishes += 1
+                        self.bytes += 2 + size
+                        if (header >> 1) & 3:
+                            tlen = (body[0] << 8) | body[1]
+                            conn.sendall(bytes([0x40, 2]) + body[2 + tlen:4 + tlen])
+                    case 8: # SUBSCRIBE
+                        num = 0
+                        offs = 2
+                        while offs < len(body):
+                            offs += 3 + ((body[offs] << 8) | body[offs + 1])
+                            num += 1
+                        conn.sendall(bytes([0x90, 2 + num]) + body[:2] + bytes(num))
+                    case 12: # PINGREQ
+                        conn.sendall(bytes([0xd0, 0]))
+                    case 14: # DISCONNECT
+                        break
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+
+def latencies(samples: list) -> dict:
+    """ latency distribution [µs] of samples [s] """
+    samples = sorted(samples)
+    n = len(samples)
+    return {"count": n,
+            "p50_us": round(samples[n // 2] * 1e6, 2),
+            "p95_us": round(samples[int(n * 0.95)] * 1e6, 2),
+            "p99_us": round(samples[int(n * 0.99)] * 1e6, 2),
+            "max_us": round(samples[-1] * 1e6, 2)}
+
+
+def rate(func, duration: float) -> float:
+    """ calls of func per second, func returns the number of items done """
+    done = 0
+    start = time.perf_counter()
+    end = start + duration
+    while time.perf_counter() < end:
+        done += func()
+    return done / (time.perf_counter() - start)
+
+
+def benchDecode(duration: float) -> dict:
+    key = getRandom(8)
+    frame = getRandom(8)
+    decryptor = Decryptor(key)
+    batch = bytes(getRandom(8 * 1024))
+    results = {
+        "decrypt_frames_s": rate(lambda: decrypt(frame, key) and 1, duration),
+        "decryptor_frames_s": rate(lambda: decryptor.decrypt(frame) and 1, duration),
+        "decrypt_batch_frames_s": rate(lambda: len(decryptor.decryptBatch(batch, False)) // 8, duration),
+        "to16bit_s": rate(lambda: to16bit(frame[1:3]) and 1, duration),
+    }
+    if co2device.np is not None:
+        results["decrypt_batch_numpy_frames_s"] = rate(
+            lambda: len(decryptor.decryptBatch(batch, True)) // 8, duration)
+    return {k: round(v) for k, v in results.items()}
+
+
+def benchReceive(duration: float, encrypted: bool) -> dict:
+    device = CO2Device(SimulatedTransport(encrypted=encrypted))
+    device.open(VENDOR, PRODUCT)
+    results = {"read_frames_s": round(rate(lambda: len(device._read_()) and 1, duration))}
+    samples = list()
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        values = {"Humidity": 0}
+        start = time.perf_counter()
+        device.receive(values)
+        samples.append(time.perf_counter() - start)
+    results["receive_latency"] = latencies(samples)
+
+    device.startReader()
+    device.receive({"Humidity": 0}) # wait for 1st values
+    samples = list()
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        values = {"Humidity": 0}
+        start = time.perf_counter()
+        device.receive(values)
+        samples.append(time.perf_counter() - start)
+    results["poll_latency_continuous_reader"] = latencies(samples)
+    device.close()
+    return results
+
+
+def benchPublish(duration: float, cfgfile: str) -> dict:
+    from co2sensorclient import Co2SensorClient
+    broker = BrokerStandIn()
+    cfg = Config.load_json(cfgfile)
+    cfg.MQTTBroker.host = "127.0.0.1"
+    cfg.MQTTBroker.port = broker.port
+    cfg.MQTTBroker.clientcertfile = ""
+    cfg.HW = "AIRCO2NTROL_COACH"
+    client = Co2SensorClient(cfg, "bench", SimulatedTransport())
+    client.connect(cfg.MQTTBroker.host, cfg.MQTTBroker.port)
+    client.loop_start()
+    while not client.is_connected():
+        time.sleep(0.01)
+
+    def publishAll(func):
+        before = broker.publishes
+        start = time.perf_counter()
+        calls = 0
+        while time.perf_counter() - start < duration:
+            func()
+            calls += 1
+        # wait until the broker stand-in received all messages
+        expected = before + calls * len(client._stTopics)
+        deadline = time.perf_counter() + 10
+        while broker.publishes < expected and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        return round(calls / elapsed), round((broker.publishes - before) / elapsed)
+
+    cycles, msgs = publishAll(lambda: client.publish_state_topics(force=True))
+    hass, hassMsgs = publishAll(client.publish_hass)
+    client.disconnect()
+    client.loop_stop()
+    client.device.close()
+    broker.close()
+    return {"publish_state_cycles_s": cycles, "publish_state_msgs_s": msgs,
+            "publish_hass_cycles_s": hass, "publish_hass_msgs_s": hassMsgs}
+
+
+def compare(results: dict, baseline: dict, path="") -> list:
+    """
+    regressions of results against a baseline: rates lower or
+    latencies higher than REGRESSION_THRESHOLD
+    """
+    regressions = list()
+    for key, value in results.items():
+        base = baseline.get(key)
+        if isinstance(value, dict) and isinstance(base, dict):
+            regressions += compare(value, base, f"{path}{key}.")
+        elif isinstance(value, (int, float)) and isinstance(base, (int, float)) and base > 0 \
+                and key not in ("count", "max_us"): # max. latency: too noisy
+            change = (value - base) / base
+            if key.endswith("_us"):
+                change = -change
+            if change < -REGRESSION_THRESHOLD:
+                regressions.append(f"{path}{key}: {base} -> {value}")
+    return regressions
+
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = OptionParser(description="CO2MqttSensor benchmark suite")
+    parser.add_option("-d", "--duration", dest="duration", type="float",
+                      help="duration [s] of each benchmark [default: %default]")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE",
+                      help="write JSON results to FILE [default: %default]")
+    parser.add_option("-b", "--baseline", dest="baseline", metavar="FILE",
+                      help="compare with JSON results FILE, exit(1) on regression")
+    parser.add_option("-c", "--cfg", dest="cfgfile", metavar="FILE",
+                      help="config file of publish benchmark [default: %default]")
+    parser.set_defaults(duration=1.0, output="./bench_results.json", cfgfile="./config.json")
+    (opts, _args) = parser.parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+
+    results = {"decode": benchDecode(opts.duration),
+               "receive_plain": benchReceive(opts.duration, False),
+               "receive_encrypted": benchReceive(opts.duration, True),
+               "publish": benchPublish(opts.duration, opts.cfgfile)}
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "machine": platform.machine(),
+              "results": results}
+    print(json.dumps(report, indent=2))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if opts.baseline and os.path.exists(opts.baseline):
+        with open(opts.baseline, "r") as f:
+            regressions = compare(results, json.load(f)["results"])
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,10 +5,23 @@ Created on 19.11.2023
 '''
 import hid
 import logging
+import threading
+import time
 from os import urandom
+from hidtransport import HidTransport
+from metrics import REGISTRY
+
+try:
+    import numpy as np # optional: vectorized batch decrypt
+except ImportError:
+    np = None
 
 TIMEOUT_MS = 5000
 LOOP_ERROR = 30
+LATEST_TIMEOUT_S = 10 # max. wait for 1st values of the continuous reader
+REDETECT_FAILURES = 8 # consecutive corrupt frames until the frame mode is detected again
+FRAME_PLAIN = "plain"
+FRAME_ENCRYPTED = "encrypted"
 
 # CO2 sensor items
 eHum1 = 0x41
@@ -19,6 +32,23 @@ eCO2_2 = 0x71  # on my mini device
 eUnkown1 = 0x6d
 eUnkown2 = 0x6e
 
+HID_READ_SECONDS = REGISTRY.histogram("co2_hid_read_seconds", "HID frame read latency",
+                                      (0.001, 0.01, 0.1, 0.5, 1, 2, 5))
+FRAMES = REGISTRY.counter("co2_frames_total", "frames read by mode plain/encrypted")
+CORRUPT_FRAMES = REGISTRY.counter("co2_corrupt_frames_total", "frames with invalid checksum by mode")
+MODE_DETECTIONS = REGISTRY.counter("co2_frame_mode_detections_total", "frame mode detections by mode")
+IGNORED_ITEMS = REGISTRY.counter("co2_ignored_items_total", "ignored frames by item code")
+RECEIVE_LOOPS = REGISTRY.histogram("co2_receive_loops", "frames read per receive()",
+                                   (1, 2, 4, 8, 16, LOOP_ERROR))
+RECEIVE_FAILURES = REGISTRY.counter("co2_receive_failures_total", "failed receive() calls")
+
+# topic name of the sensor items
+ITEM_TOPICS = {eCO2: "CO2", eTemp: "Temperature", eHum1: "Humidity", eHum2: "Humidity"}
+
+def itemTopic(item) -> str:
+    """ topic name of the diagnostic entity of an item code, e.g. 0x71 -> 'Item71' """
+    return f"Item{item:02X}"
+
 def listAllDevices():
     for device_dict in hid.enumerate():
         keys = list(device_dict.keys())
@@ -44,19 +74,79 @@ def lookforDevice(vendor_id, product_id):
     return False
 
 
+def getDeviceKey(path) -> str:
+    """
+    get a topic level compatible key of a device HID path,
+    e.g. b'/dev/hidraw1' -> 'hidraw1', b'1-1.2:1.0' -> '1_1_2_1_0'
+    """
+    if isinstance(path, bytes):
+        path = path.decode("utf-8", "replace")
+    name = path.rstrip("/").split("/")[-1]
+    return "".join(c if c.isalnum() else "_" for c in name).strip("_")
+
+
 def to16bit(val):
     return (val[0] << 8) | val[1]
 
+def isValidFrame(frame) -> bool:
+    """ plain or decrypted frame: end marker 0x0d & checksum of item & value """
+    return frame[4] == 0x0d and (sum(frame[:3]) & 0xff) == frame[3]
+
+def toUnit(item, val):
+    """
+    convert a raw 16 bit item value to its unit: ppm, °C or %
+    """
+    if eTemp == item:
+        return val / 16.0 - 273.15
+    if eHum1 == item or eHum2 == item:
+        return val / 100
+    return val
+
+""" decimals of the serialised unit values """
+UNIT_DECIMALS = {eTemp: 2, eHum1: 2, eHum2: 2}
+
+class Reading(object):
+    """
+    decoded device reading: item code, raw 16 bit value & monotonic timestamp,
+    unit conversion & rounding are done on serialisation only, see json()
+    """
+    __slots__ = ("item", "raw", "ts")
+
+    def __init__(self, item: int, raw: int, ts: float):
+        self.item = item
+        self.raw = raw
+        self.ts = ts
+
+    @property
+    def value(self):
+        """ value in its unit: ppm, °C or % """
+        return toUnit(self.item, self.raw)
+
+    def json(self):
+        """ numeric JSON value """
+        decimals = UNIT_DECIMALS.get(self.item)
+        return self.value if decimals is None else round(self.value, decimals)
+
+    def __float__(self):
+        return float(self.json())
+
+    def __repr__(self):
+        return f"Reading({hex(self.item)}, {self.raw}, {self.ts:.3f})"
+
 def getRandom(num = 8):
     return list(urandom(num))
 
+DECRYPT_CSTATE = [0x48,  0x74,  0x65,  0x6D,  0x70,  0x39,  0x39,  0x65]
+DECRYPT_SHUFFLE = [2, 4, 0, 7, 1, 6, 5, 3]
+
 def decrypt(data,key):
     """
     https://github.com/JsBergbau/TFACO2AirCO2ntrol_CO2Meter/blob/main/co2monitor.py
+    reference implementation, see Decryptor for the table driven version
     """
-    cstate = [0x48,  0x74,  0x65,  0x6D,  0x70,  0x39,  0x39,  0x65]
+    cstate = DECRYPT_CSTATE
 
-    shuffle = [2, 4, 0, 7, 1, 6, 5, 3]
+    shuffle = DECRYPT_SHUFFLE
 
     phase1 = [0] * 8
     for i, o in enumerate(shuffle):
@@ -80,6 +170,85 @@ def decrypt(data,key):
 
     return out
 
+def encrypt(data, key):
+    """
+    inverse of decrypt(), used to simulate devices with encrypted frames
+    """
+    ctmp = [((c >> 4) | (c << 4)) & 0xff for c in DECRYPT_CSTATE]
+    phase3 = [(data[i] + ctmp[i]) & 0xff for i in range(8)]
+    phase2 = [((phase3[i] << 3) | (phase3[(i + 1) % 8] >> 5)) & 0xff for i in range(8)]
+    phase1 = [phase2[i] ^ key[i] for i in range(8)]
+    return [phase1[o] for o in DECRYPT_SHUFFLE]
+
+class Decryptor(object):
+    """
+    table driven decrypt() for a fixed key
+
+    the shuffle, XOR, rotate and subtract stages of decrypt() are folded
+    into lookup tables built once per key:
+    out[i] = HI[i][b] + LO[i][b'] with b, b' the two source bytes of
+    position i - the rotate stage leaves bits 0..4 to HI and bits 5..7 to LO
+    """
+
+    def __init__(self, key):
+        self.key = list(key)
+        ctmp = [((c >> 4) | (c << 4)) & 0xff for c in DECRYPT_CSTATE]
+        # src[i]: index of raw data byte shuffled to position i
+        src = [0] * 8
+        for i, o in enumerate(DECRYPT_SHUFFLE):
+            src[o] = i
+        self._src = src
+        self._prev = [src[(i - 1 + 8) % 8] for i in range(8)]
+        # per frame tables, ctmp subtraction folded into HI
+        self._hi = [bytes((((b ^ self.key[i]) >> 3) - ctmp[i]) & 0xff for b in range(256))
+                    for i in range(8)]
+        self._lo = [bytes(((b ^ self.key[(i - 1 + 8) % 8]) << 5) & 0xff for b in range(256))
+                    for i in range(8)]
+        self._pos = tuple(zip(self._hi, self._lo, self._src, self._prev))
+        # batch tables, applied column wise by bytes.translate()
+        self._rot3 = [bytes((b ^ self.key[i]) >> 3 for b in range(256)) for i in range(8)]
+        self._sub = [bytes((b - ctmp[i]) & 0xff for b in range(256)) for i in range(8)]
+        if np is not None:
+            self._npSrc = np.array(src)
+            self._npKey = np.array([self.key[i] for i in range(8)], dtype=np.uint8)
+            self._npCtmp = np.array(ctmp, dtype=np.uint8)
+
+    def decrypt(self, data) -> list:
+        """ decrypt a single 8 byte frame, same result as decrypt(data, key) """
+        return [(hi[data[s]] + lo[data[p]]) & 0xff for hi, lo, s, p in self._pos]
+
+    def decryptBatch(self, buf, useNumpy=None) -> bytes:
+        """
+        decrypt many raw 8 byte frames at once
+
+        buf: bytes, bytearray or memoryview, length multiple of 8
+        useNumpy: None = use NumPy when installed, True/False forces the path
+        returns the decrypted frames as one bytes buffer of same layout
+        """
+        if len(buf) % 8:
+            raise ValueError("buffer length is not a multiple of the 8 byte frame size")
+        if useNumpy is None:
+            useNumpy = np is not None
+        if useNumpy:
+            return self._decryptBatchNumpy(buf)
+        buf = bytes(buf)
+        n = len(buf) // 8
+        out = bytearray(len(buf))
+        for i in range(8):
+            hi = buf[self._src[i]::8].translate(self._rot3[i])
+            lo = buf[self._prev[i]::8].translate(self._lo[i])
+            col = (int.from_bytes(hi, "little") | int.from_bytes(lo, "little")).to_bytes(n, "little")
+            out[i::8] = col.translate(self._sub[i])
+        return bytes(out)
+
+    def _decryptBatchNumpy(self, buf) -> bytes:
+        if np is None:
+            raise RuntimeError("NumPy is not installed")
+        frames = np.frombuffer(buf, dtype=np.uint8).reshape(-1, 8)[:, self._npSrc]
+        phase2 = frames ^ self._npKey
+        phase3 = (phase2 >> 3) | (np.roll(phase2, 1, axis=1) << 5)
+        return (phase3 - self._npCtmp).tobytes()
+
 class CO2Device(object):
     """
     CO2 Device - see details at
@@ -89,23 +258,163 @@ class CO2Device(object):
 
     """
 
-    def __init__(self):
+    def __init__(self, transport=None):
+        """
+        transport: enumerates & opens devices, default: USB HID via hidapi
+        see hidtransport for recording, replay & simulation
+        """
+        self._transport = transport if transport else HidTransport()
         self._dev = None
+        self.path = None
         self.key=getRandom(8)
+        self._decryptor = Decryptor(self.key)
+        self.frameMode = None # FRAME_PLAIN or FRAME_ENCRYPTED, None: not detected yet
+        self._corrupt = 0 # consecutive corrupt frames
+        self._reader = None
+        self._readerStop = threading.Event()
+        self._latest = threading.Condition()
+        self.items = dict() # item code -> latest Reading of every item code sent by the device
+        self.itemStats = dict() # item code -> [frames, min raw value, max raw value, 1st & last monotonic timestamp]
+        self.listeners = list() # listener(item, value, timestamp) called for every decoded frame
 
     def hasNoHumiditySens(self, HW):
         return HW == "AIRCO2NTROL_MINI"
 
     def close(self):
-        self._dev.close()
+        self.stopReader()
+        if self._dev:
+            try:
+                self._dev.close()
+            except (IOError, ValueError) as ex: # e.g. device unplugged
+                logging.debug(f"device close: {ex}")
+            self._dev = None
+
+    def reopen(self, vendor, product, path=None) -> bool:
+        """
+        open the device again after a device loss, e.g. USB re-plug:
+        new session key, empty value table, the frame mode is detected again
+        """
+        self.close()
+        self.key = getRandom(8)
+        self._decryptor = Decryptor(self.key)
+        self.frameMode = None
+        self._corrupt = 0
+        with self._latest: # values read before the device loss are stale
+            self.items.clear()
+            self.itemStats.clear()
+        return bool(self.open(vendor, product, path))
+
+    def startReader(self):
+        """
+        start continuous reader mode: a background thread drains the HID
+        endpoint and stores every decoded frame in the latest value table
+        """
+        if self._reader is None:
+            self._readerStop.clear()
+            self._reader = threading.Thread(target=self._readerLoop,
+                                            name="co2reader", daemon=True)
+            self._reader.start()
+
+    def stopReader(self):
+        if self._reader:
+            self._readerStop.set()
+            self._reader.join(TIMEOUT_MS / 1000 + 1)
+            self._reader = None
+
+    def isReading(self) -> bool:
+        return self._reader is not None and self._reader.is_alive()
+
+    def _readerLoop(self):
+        logging.debug("continuous reader started")
+        while not self._readerStop.is_set():
+            rec = self._read_()
+            if not rec:
+                logging.error("continuous reader stopped: no data from device")
+                break
+            val = to16bit(rec[1:3])
+            self._store(rec[0], val)
+            self._notify(rec[0], val)
+        with self._latest:
+            self._latest.notify_all()
+
+    def _store(self, item, val) -> Reading:
+        """ store a decoded frame in the value table & item statistics """
+        reading = Reading(item, val, time.monotonic())
+        with self._latest:
+            self.items[item] = reading
+            stats = self.itemStats.get(item)
+            if stats is None:
+                self.itemStats[item] = [1, val, val, reading.ts, reading.ts]
+            else:
+                stats[0] += 1
+                stats[1] = min(stats[1], val)
+                stats[2] = max(stats[2], val)
+                stats[4] = reading.ts
+            self._latest.notify_all()
+        return reading
+
+    def probe(self, duration: float) -> dict:
+        """
+        read all frames for duration [s],
+        returns the item statistics, see itemStats
+        """
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            if self._reader:
+                time.sleep(min(1, max(0, end - time.monotonic())))
+                continue
+            rec = self._read_()
+            if not rec:
+                break
+            self._store(rec[0], to16bit(rec[1:3]))
+        with self._latest:
+            return {item: list(stats) for item, stats in self.itemStats.items()}
+
+    def _notify(self, item, val):
+        if self.listeners:
+            ts = time.time()
+            for listener in self.listeners:
+                listener(item, val, ts)
+
+    def _hasLatest(self, bHum) -> bool:
+        return eCO2 in self.items and eTemp in self.items and \
+            (not bHum or eHum1 in self.items or eHum2 in self.items)
+
+    def _receiveLatest(self, sensorValues: dict, bHum) -> bool:
+        """
+        fill sensorValues from the latest value table,
+        blocks only until the 1st complete set of values has been read
+        """
+        with self._latest:
+            self._latest.wait_for(lambda: self._hasLatest(bHum) or not self.isReading(),
+                                  LATEST_TIMEOUT_S)
+            if not self.isReading():
+                return False
+            if not self._hasLatest(bHum):
+                logging.error("continuous reader: missing CO2/T/H value items")
+                return False
+            sensorValues["CO2"] = self.items[eCO2]
+            sensorValues["Temperature"] = self.items[eTemp]
+            if bHum:
+                sensorValues["Humidity"] = max((self.items[i] for i in (eHum1, eHum2) if i in self.items),
+                                               key=lambda r: r.ts)
+        return True
 
-    def open(self, vendor, product):
-        if lookforDevice(vendor, product):
+    def open(self, vendor, product, path=None):
+        """
+        open the 1st device with vendor & product id or
+        the device with given HID path, see HidTransport.enumerate()
+        """
+        if self._transport.enumerate(vendor, product):
             try:
                 logging.debug(
-                    f"try to open vendor {hex(vendor)} - product {hex(product)}")
-                self._dev = hid.device()
-                self._dev.open(vendor, product)
+                    f"try to open vendor {hex(vendor)} - product {hex(product)} path {path}")
+                self._dev = self._transport.open(vendor, product, path)
+                self.path = path
+                if getattr(self._dev, "sessionKey", None):
+                    # replayed frames are encrypted by the recorded key
+                    self.key = list(self._dev.sessionKey)
+                    self._decryptor = Decryptor(self.key)
                 man = self._dev.get_manufacturer_string()
                 prod = self._dev.get_product_string()
                 logging.debug(
@@ -142,61 +451,119 @@ class CO2Device(object):
     def _read_(self):
         if self._dev:
             try:
-                raw = self._dev.read(8, TIMEOUT_MS)
-
-                if raw[4] == 0x0d and (sum(raw[:3]) & 0xff) == raw[3]:
-                    data = raw
-                else:
-                    logging.debug("decrypting")
-                    data = decrypt(raw,self.key)
+                for _frame in range(LOOP_ERROR): # corrupt frames are skipped
+                    if REGISTRY.enabled:
+                        start = time.perf_counter()
+                        raw = self._dev.read(8, TIMEOUT_MS)
+                        HID_READ_SECONDS.observe(time.perf_counter() - start)
+                    else:
+                        raw = self._dev.read(8, TIMEOUT_MS)
+                    if len(raw) < 8:
+                        logging.error(f"no data from CO2 device within {TIMEOUT_MS} ms")
+                        return list()
+                    data = self._decode(raw)
+                    if data is not None:
+                        return data
+                logging.error(f"{LOOP_ERROR} corrupt frames from CO2 device")
+                return list()
 
             except IOError as ex:
                 logging.error(ex)
-                man = self._dev.get_manufacturer_string()
-                prod = self._dev.get_product_string()
+                try:
+                    man = self._dev.get_manufacturer_string()
+                    prod = self._dev.get_product_string()
+                except (IOError, ValueError): # device unplugged
+                    man = prod = "n/a"
                 logging.error(
                     f"IO Error CO2 device: Manufacturer = {man} , Product = {prod}")
                 return list()
-            return data
+        return list()
+
+    def _decode(self, raw):
+        """
+        plain or decrypted frame, None: corrupt frame.
+        The frame mode is detected once and kept until
+        REDETECT_FAILURES consecutive frames are corrupt
+        """
+        mode = self.frameMode
+        if mode != FRAME_ENCRYPTED and isValidFrame(raw):
+            data = raw
+            mode = FRAME_PLAIN
+        elif mode != FRAME_PLAIN:
+            data = self._decryptor.decrypt(raw)
+            mode = FRAME_ENCRYPTED if isValidFrame(data) else None
+        else:
+            data = None
+            mode = None
+        if mode is None:
+            self._corrupt += 1
+            CORRUPT_FRAMES.inc(mode=self.frameMode or "unknown")
+            if self._corrupt == REDETECT_FAILURES and self.frameMode:
+                logging.warning(f"{self._corrupt} corrupt {self.frameMode} frames, detecting frame mode again")
+                self.frameMode = None
+            return None
+        if self.frameMode is None:
+            logging.info(f"CO2 device frame mode: {mode}")
+            MODE_DETECTIONS.inc(mode=mode)
+            self.frameMode = mode
+        self._corrupt = 0
+        FRAMES.inc(mode=mode)
+        return data
 
     def receive(self, sensorValues: dict()) -> bool:
+        """
+        read frames until CO2, temperature and - if initialised in
+        sensorValues - humidity were received, values are stored as Reading
+        """
         bCO2 = True
         bTemp = True
         if "Humidity" in sensorValues:
             bHum = True
         else:
             bHum = False  # not availbale hence do not wait for
-        logging.debug(f"----> waiting for {str(sensorValues.keys())} values froom device")
+        if self._reader:
+            return self._receiveLatest(sensorValues, bHum)
+        debug = logging.root.isEnabledFor(logging.DEBUG)
+        if debug:
+            logging.debug(f"----> waiting for {str(sensorValues.keys())} values froom device")
         loop=0
         while (bHum or bCO2 or bTemp):  # wait since value was not received
             loop+=1
             if loop>=LOOP_ERROR:
                 logging.error("unexpected values from device, missing CO2/T/H value items")
+                RECEIVE_LOOPS.observe(loop)
+                RECEIVE_FAILURES.inc()
                 return False
 
             rec = self._read_()
             if len(rec):
                 item = rec[0]
                 val = to16bit(rec[1:3])
+                reading = self._store(item, val)
+                self._notify(item, val)
 
                 if eCO2 == item:
-                    logging.debug(f"CO2 = {val} ppm")
-                    sensorValues["CO2"] = f"{val}"
+                    sensorValues["CO2"] = reading
                     bCO2 = False
                 elif eTemp == item:
-                    logging.debug(f"Temperature = {val / 16.0 - 273.15:.2f} °C")
-                    sensorValues["Temperature"] = f"{val / 16.0 - 273.15:.2f}"
+                    sensorValues["Temperature"] = reading
                     bTemp = False
                     # f = t * 9 / 5 + 32
                 elif bHum and (eHum1 == item or eHum2 == item):
-                    logging.debug(f"Humidity = {val/100:2.2f} %")
-                    sensorValues["Humidity"] = f"{val/100 :2.2f}"
+                    sensorValues["Humidity"] = reading
                     bHum = False
                 else:
-                    logging.debug(
-                        f"{loop}:ignoring sensor item {hex(item)}={val} (value)")
+                    IGNORED_ITEMS.inc(item=hex(item))
+                    if debug:
+                        logging.debug(
+                            f"{loop}:ignoring sensor item {hex(item)}={val} (value)")
+                    continue
+                if debug:
+                    logging.debug(f"{ITEM_TOPICS[item]} = {toUnit(item, val):.2f}")
             else:
+                RECEIVE_FAILURES.inc()
                 return False
+        RECEIVE_LOOPS.observe(loop)
         logging.debug("<--- received values from device")
         return True
 
@@ -15,16 +15,98 @@ CO2MqttSensor
 
 import sys
 import os
+import time
+from datetime import datetime
 
 from optparse import OptionParser
-from co2sensorclient import startClient
+from co2sensorclient import startClient, createTransport, probeDevice
+from co2device import ITEM_TOPICS, toUnit
+from historylog import HistoryReader, downsample, export
+from config import Config
 
 __all__ = []
-__version__ = "0.2.5"
-__updated__ = '2025-11-16'
+__version__ = "0.3.0"
+__updated__ = '2026-10-17'
 __author__ = "irimi@gmx.de"
 
 
+def parseTime(value: str) -> float:
+    """ timestamp of ISO date/time (local time) or seconds since epoch """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def parseItems(names: list):
+    """ item codes of topic names or hex item codes, None: all items, ValueError: unknown item """
+    if not names:
+        return None
+    items = set()
+    for name in names:
+        codes = [item for item, tp in ITEM_TOPICS.items() if tp == name]
+        if not codes:
+            try:
+                codes = [int(name, 16)]
+            except ValueError:
+                valid = ", ".join(sorted(set(ITEM_TOPICS.values())))
+                raise ValueError(f"unknown item {name}, use {valid} or a hex item code") from None
+        items.update(codes)
+    return items
+
+def history(argv):
+    '''history subcommand: time range query & export of the history log'''
+
+    parser = OptionParser(usage="%prog history [options]",
+                          description="export readings of the history log (option HISTORY)")
+    parser.add_option("-c", "--cfg", dest="cfgfile", metavar="FILE",
+                      help="config file of the history directory [default: %default]")
+    parser.add_option("--dir", dest="dir", metavar="DIR",
+                      help="history directory, overrides the config file")
+    parser.add_option("--device", dest="device", default="",
+                      help="device key in multi device mode, e.g. 1_1_2_1_0")
+    parser.add_option("--from", dest="start",
+                      help="start: ISO date/time or seconds since epoch [default: 24h ago]")
+    parser.add_option("--to", dest="end",
+                      help="end: ISO date/time or seconds since epoch [default: now]")
+    parser.add_option("--item", dest="items", action="append",
+                      help="CO2, Temperature, Humidity or hex item code, repeatable [default: all]")
+    parser.add_option("--step", dest="step", type="float", default=0,
+                      help="downsample to means of STEP [s], 0: all readings [default: %default]")
+    parser.add_option("--format", dest="fmt", type="choice", choices=["csv", "json"], default="csv",
+                      help="csv or json [default: %default]")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE",
+                      help="output file [default: stdout]")
+    parser.set_defaults(cfgfile="./config.json")
+    (opts, _args) = parser.parse_args(argv)
+    try:
+        items = parseItems(opts.items)
+    except ValueError as e:
+        parser.error(str(e))
+
+    path = opts.dir
+    if not path:
+        cfg = Config.load_json(opts.cfgfile) if os.path.exists(opts.cfgfile) else dict()
+        path = (cfg.get("HISTORY") or dict()).get("DIR", "./history")
+    path = os.path.join(path, opts.device)
+    if not os.path.isdir(path):
+        print(f"no history directory {path}", file=sys.stderr)
+        return 1
+    end = parseTime(opts.end) if opts.end else time.time()
+    start = parseTime(opts.start) if opts.start else end - 86400
+
+    records = HistoryReader(path).query(start, end, items)
+    if opts.step > 0:
+        rows = downsample(records, opts.step, toUnit)
+    else:
+        rows = ((ts, item, toUnit(item, raw)) for ts, item, raw in records)
+    itemName = lambda item: ITEM_TOPICS.get(item, hex(item))
+    if opts.output:
+        with open(opts.output, "w") as out:
+            export(rows, out, opts.fmt, itemName)
+    else:
+        export(rows, sys.stdout, opts.fmt, itemName)
+    return 0
+
 def main(argv=None):
     '''Command line options.'''
 
@@ -35,9 +117,12 @@ def main(argv=None):
 
     if argv is None:
         argv = sys.argv[1:]
+    if argv and "history" == argv[0]:
+        return history(argv[1:])
     # setup option parser
     parser = OptionParser(
         version=program_version_string,
+        usage="%prog [options] | %prog history [options]",
         epilog="your CO2Sensor MQTT client for Home Assistant",
         description=program_license)
 
@@ -48,13 +133,55 @@ def main(argv=None):
         help="set config file [default: %default]",
         metavar="FILE")
 
-    parser.set_defaults(cfgfile="./config.json")
+    parser.add_option(
+        "-a",
+        "--asyncio",
+        dest="asyncio",
+        action="store_true",
+        help="run client in asyncio runtime mode [default: %default]")
+
+    parser.add_option(
+        "--record",
+        dest="record",
+        help="record raw device frames to capture FILE",
+        metavar="FILE")
+
+    parser.add_option(
+        "--replay",
+        dest="replay",
+        help="replay device frames of capture FILE instead of device access",
+        metavar="FILE")
+
+    parser.add_option(
+        "--simulate",
+        dest="simulate",
+        type="choice",
+        choices=["plain", "encrypted"],
+        help="simulate device with plain or encrypted frames")
+
+    parser.add_option(
+        "--max-speed",
+        dest="maxSpeed",
+        action="store_true",
+        help="replay/simulate frames at max. speed instead of real-time")
+
+    parser.add_option(
+        "--probe",
+        dest="probe",
+        type="float",
+        help="probe mode: print frequency & value range of all device item codes read within PROBE seconds",
+        metavar="PROBE")
+
+    parser.set_defaults(cfgfile="./config.json", asyncio=False, maxSpeed=False)
     (opts, _args) = parser.parse_args(argv)
 
     if opts.cfgfile:
         print("cfgfile = %s" % opts.cfgfile)
 
-    startClient(opts.cfgfile, __version__)
+    transport = createTransport(opts.record, opts.replay, opts.simulate, opts.maxSpeed)
+    if opts.probe:
+        return probeDevice(opts.cfgfile, opts.probe, transport)
+    startClient(opts.cfgfile, __version__, opts.asyncio, transport)
 
 if __name__ == "__main__":
     sys.exit(main())
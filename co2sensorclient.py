@@ -4,26 +4,41 @@ Created on 17.11.2023
 @author: irimi
 '''
 
-import logging, os
+import logging, os, threading, time
+from functools import partial
 import MQTTClient as hass
-from config import Config
-from co2device import CO2Device
+from config import Config, CONFIG_SCHEMA, LOG_LEVEL
+from co2device import CO2Device, Reading, getDeviceKey, itemTopic, ITEM_TOPICS, toUnit, eCO2
+from hidtransport import HidTransport, RecordingTransport, ReplayTransport, SimulatedTransport
+from windowstats import WindowStats, SlidingMean
+from derived import dewPoint, absoluteHumidity
+from scheduler import AdaptiveScheduler
+from historylog import HistoryLog
+from supervisor import DeviceSupervisor
+from backfill import BackfillBuffer, encodeBatch
+from metrics import REGISTRY
 
 MQTT_CLIENT_ID = 'co2sensor'
 
-""" Logging level: INFO, DEBUG, ERROR, WARN  """
-LOG_LEVEL = {
-    "INFO": logging.INFO,
-    "ERROR": logging.ERROR,
-    "WARN": logging.WARN,
-    "DEBUG": logging.DEBUG
-}
+""" option REFRESH_COMMAND: button topic & its command topic level """
+REFRESH_TOPIC = "Refresh"
+REFRESH_CMD = "cmd"
+""" option REFRESH_COMMAND: [s] states published within are fresh, no further device read """
+REFRESH_WINDOW = 0.5
+
+BACKFILL_SAMPLES = REGISTRY.counter("co2_backfill_samples_total", "samples published in backfill batches")
+REFRESH_SECONDS = REGISTRY.histogram("co2_refresh_seconds", "refresh command latency until state publish",
+                                     (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+
+""" option DERIVED: derived topic -> enabling option """
+DERIVED_OPTIONS = {'DewPoint': "DEW_POINT", 'AbsoluteHumidity': "ABSOLUTE_HUMIDITY"}
 
 class Co2SensorClient (hass.MQTTClient):
     """  CO2 Sensor MQTT client class """
 
-    def __init__(self, cfg, version):
+    def __init__(self, cfg, version, transport=None):
         self.version = version
+        self.deviceTransport = transport if transport else HidTransport()
         super().__init__(cfg, MQTT_CLIENT_ID)
 
     def setupClientTopics(self)->dict:
@@ -35,8 +50,22 @@ class Co2SensorClient (hass.MQTTClient):
         clientTopics = {'CO2': hass.HASS_COMPONENT_SENSOR,
                               'Temperature': hass.HASS_COMPONENT_SENSOR,
                               'Humidity': hass.HASS_COMPONENT_SENSOR}
+        derived = self.cfg.get("DERIVED")
+        if derived:
+            for tp, option in DERIVED_OPTIONS.items():
+                if derived.get(option, True):
+                    clientTopics[tp] = hass.HASS_COMPONENT_SENSOR
+            for minutes in derived.get("CO2_AVERAGE", []):
+                clientTopics[f'CO2Avg{minutes}'] = hass.HASS_COMPONENT_SENSOR
+        self._itemTopics = {itemTopic(item) for item in self._itemEntities()}
+        for tp in self._itemTopics:
+            clientTopics[tp] = hass.HASS_COMPONENT_SENSOR
         return clientTopics
 
+    def _itemEntities(self) -> list:
+        """ option ITEM_ENTITIES: item codes published as diagnostic entities """
+        return [int(code, 16) for code in self.cfg.get("ITEM_ENTITIES", [])]
+
     def setupHassDiscoveryConfigs(self) -> dict:
         """
         get a dict() which defines the required config topics
@@ -62,54 +91,515 @@ class Co2SensorClient (hass.MQTTClient):
                                hass.HASS_CONFIG_STATECLASS : "measurement"
                                }
                         }
+        hassconfigs.update(self._derivedHassConfigs())
+        for item in self._itemEntities():
+            hassconfigs[itemTopic(item)] = {hass.HASS_CONFIG_ICON:"mdi:chip",
+                               hass.HASS_CONFIG_VALUE_TEMPLATE :f"{{{{ value_json.item_{item:02x}  }}}}",
+                               hass.HASS_CONFIG_STATECLASS : "measurement",
+                               hass.HASS_CONFIG_ENTITY_CATEGORY : "diagnostic"
+                               }
+        return hassconfigs
+
+    def _derivedHassConfigs(self) -> dict:
+        """ HASS configs of option DERIVED """
+        derived = self.cfg.get("DERIVED")
+        if not derived:
+            return dict()
+        derivedConfigs = {'DewPoint': {hass.HASS_CONFIG_ICON:"mdi:thermometer-water",
+                                       hass.HASS_CONFIG_DEVICE_CLASS : "temperature",
+                                       hass.HASS_CONFIG_VALUE_TEMPLATE :"{{ value_json.dew_point  }}",
+                                       hass.HASS_CONFIG_UNIT : "°C",
+                                       hass.HASS_CONFIG_STATECLASS : "measurement"
+                                       },
+                          'AbsoluteHumidity': {hass.HASS_CONFIG_ICON:"mdi:water",
+                                       hass.HASS_CONFIG_VALUE_TEMPLATE :"{{ value_json.absolute_humidity  }}",
+                                       hass.HASS_CONFIG_UNIT : "g/m³",
+                                       hass.HASS_CONFIG_STATECLASS : "measurement"
+                                       }
+                          }
+        hassconfigs = {tp: cfg for tp, cfg in derivedConfigs.items()
+                       if derived.get(DERIVED_OPTIONS[tp], True)}
+        for minutes in derived.get("CO2_AVERAGE", []):
+            hassconfigs[f'CO2Avg{minutes}'] = {hass.HASS_CONFIG_ICON:"mdi:molecule-co2",
+                               hass.HASS_CONFIG_DEVICE_CLASS : "carbon_dioxide",
+                               hass.HASS_CONFIG_VALUE_TEMPLATE :f"{{{{ value_json.carbon_dioxide_avg{minutes}  }}}}",
+                               hass.HASS_CONFIG_UNIT : "ppm",
+                               hass.HASS_CONFIG_STATECLASS : "measurement"
+                               }
         return hassconfigs
 
     def setupDevice(self):
         """
         setup device specific sensors
         """
-        self.device = CO2Device()
-        if not self.device.open(int(self.cfg.VENDOR, 16), int(self.cfg.PRODUCT, 16)):
-            logging.error(f"access failure: vendor: {self.cfg.VENDOR} product: {self.cfg.PRODUCT}")
-            logging.error("program exit(-1)")
-            exit(-1)
+        vendor = int(self.cfg.VENDOR, 16)
+        product = int(self.cfg.PRODUCT, 16)
+        if self.cfg.get("MULTI_DEVICE", False):
+            # device key of the stable device id, hidraw nodes are renumbered on reboot & re-plug
+            deviceIds = self.deviceTransport.deviceIds(vendor, product)
+            paths = sorted(deviceIds)
+            logging.info(f"multi device mode: {len(paths)} device(s) found")
+        else:
+            paths = [None]
+        if len(paths) == 0:
+            paths = [None] # open() reports the missing device
+
+        self.devices = dict() # device key -> CO2Device, key "" in single device mode
+        self.supervisor = DeviceSupervisor(self.deviceTransport, vendor, product, self._onDeviceRecovered)
+        for path in paths:
+            device = CO2Device(self.deviceTransport)
+            key = getDeviceKey(deviceIds[path]) if path else ""
+            self.devices[key] = device
+            if not device.open(vendor, product, path):
+                logging.error(f"access failure: vendor: {self.cfg.VENDOR} product: {self.cfg.PRODUCT} path: {path}")
+                device.path = path
+                self.supervisor.lost(key, device)
+                continue
+            if self.cfg.get("CONTINUOUS_READ", False):
+                logging.debug("continuous reader mode enabled")
+                device.startReader()
+        self.device = next(iter(self.devices.values()))
         if self.device.hasNoHumiditySens(self.cfg.HW):
             logging.debug("Humidity sensor not supported by and removed")
-            del self.CLIENT_TOPICS["Humidity"]
-            del self.HASSCONFIGS["Humidity"]
+            for tp in ("Humidity", "DewPoint", "AbsoluteHumidity"):
+                self.CLIENT_TOPICS.pop(tp, None)
+                self.HASSCONFIGS.pop(tp, None)
+
+        if self.cfg.get("MULTI_DEVICE", False) and "" not in self.devices:
+            # one topic tree per device: <baseTopic>/<device key>/<topic>,
+            # no device found at startup: single device topics of the 1st device plugged in
+            self.CLIENT_TOPICS = {f"{key}/{tp}": comp for key in self.devices
+                                  for tp, comp in self.CLIENT_TOPICS.items()}
+            self.HASSCONFIGS = {f"{key}/{tp}": cfg for key in self.devices
+                                for tp, cfg in self.HASSCONFIGS.items()}
 
         logging.debug(
             f"SW activated sensors due to HW={self.cfg.HW} : {str(self.CLIENT_TOPICS.keys())}")
 
+        self._setupAggregation()
+        self._setupHistory()
+        self._setupDerived()
+        self._setupScheduler()
+        self._setupRefreshCommand()
+        self._setupBackfill()
+        return self._getMqttDevice("")
+
+    def _setupHistory(self):
+        """
+        option HISTORY: log every decoded reading to the local history,
+        one log directory per device in multi device mode
+        """
+        self._historyLogs = list()
+        history = self.cfg.get("HISTORY")
+        if not history:
+            return
+        for key, device in self.devices.items():
+            log = HistoryLog(os.path.join(history.get("DIR", "./history"), key),
+                             history.get("FLUSH_RECORDS", 256),
+                             history.get("FLUSH_INTERVAL", 60),
+                             history.get("KEEP_DAYS", 0))
+            self._historyLogs.append(log)
+            device.listeners.append(lambda item, val, ts, log=log: log.append(ts, item, val))
+
+    def _setupDerived(self):
+        """
+        option DERIVED: dew point & absolute humidity of each poll and
+        sliding CO2 means of the last CO2_AVERAGE minutes of all readings
+        """
+        self._co2Means = dict() # topic -> SlidingMean
+        self._derivedLock = threading.Lock()
+        derived = self.cfg.get("DERIVED")
+        if not derived:
+            return
+        for key, device in self.devices.items():
+            prefix = f"{key}/" if key else ""
+            for minutes in derived.get("CO2_AVERAGE", []):
+                self._co2Means[f"{prefix}CO2Avg{minutes}"] = SlidingMean(minutes * 60)
+            if derived.get("CO2_AVERAGE"):
+                device.listeners.append(partial(self._onDerivedReading, prefix))
+
+    def _onDerivedReading(self, prefix, item, val, ts):
+        """ device listener: feed the sliding CO2 means """
+        if eCO2 == item:
+            with self._derivedLock:
+                for minutes in self.cfg.DERIVED.CO2_AVERAGE:
+                    self._co2Means[f"{prefix}CO2Avg{minutes}"].append(ts, val)
+
+    def _updateDerived(self):
+        """ derived values of the polled values """
+        now = time.time()
+        for key in self.devices:
+            prefix = f"{key}/" if key else ""
+            temp = self.TopicValues.get(f"{prefix}Temperature")
+            hum = self.TopicValues.get(f"{prefix}Humidity")
+            if isinstance(temp, Reading) and isinstance(hum, Reading):
+                if f"{prefix}DewPoint" in self.TopicValues:
+                    self.TopicValues[f"{prefix}DewPoint"] = round(dewPoint(float(temp), float(hum)), 2)
+                if f"{prefix}AbsoluteHumidity" in self.TopicValues:
+                    self.TopicValues[f"{prefix}AbsoluteHumidity"] = round(absoluteHumidity(float(temp), float(hum)), 2)
+        with self._derivedLock:
+            for tp, mean in self._co2Means.items():
+                value = mean.mean(now)
+                if value is not None and tp in self.TopicValues:
+                    self.TopicValues[tp] = round(value)
+
+    def _setupScheduler(self):
+        """
+        option ADAPTIVE_REFRESH: poll interval adapted to the rate of change,
+        the current interval is published as diagnostic entity
+        """
+        self.scheduler = None
+        adaptive = self.cfg.get("ADAPTIVE_REFRESH")
+        if not adaptive:
+            return
+        self.scheduler = AdaptiveScheduler(adaptive.get("MIN", 10),
+                                           adaptive.get("MAX", 600),
+                                           adaptive.get("SLOPE", {"CO2": 50, "Temperature": 0.5}))
+        self.CLIENT_TOPICS["RefreshInterval"] = hass.HASS_COMPONENT_SENSOR
+        self.HASSCONFIGS["RefreshInterval"] = {hass.HASS_CONFIG_ICON: "mdi:timer-outline",
+                                               hass.HASS_CONFIG_DEVICE_CLASS: "duration",
+                                               hass.HASS_CONFIG_VALUE_TEMPLATE: "{{ value_json.duration  }}",
+                                               hass.HASS_CONFIG_UNIT: "s",
+                                               hass.HASS_CONFIG_STATECLASS: "measurement",
+                                               hass.HASS_CONFIG_ENTITY_CATEGORY: "diagnostic"}
+        if self.cfg.get("CONTINUOUS_READ", False):
+            # fast changes detected by the reader start the next cycle immediately
+            for key, device in self.devices.items():
+                device.listeners.append(partial(self._onScheduleReading, key))
+
+    def _onScheduleReading(self, key, item, val, _ts):
+        """ device listener: wake up the client loop on a fast change """
+        tp = ITEM_TOPICS.get(item)
+        if tp and self.scheduler.interval > self.scheduler.minimum and \
+           self.scheduler.exceeds(f"{key}/{tp}" if key else tp, tp, toUnit(item, val), time.monotonic()):
+            self.wakeup()
+
+    def _updateScheduler(self):
+        """ next poll interval by the slopes of the polled values """
+        samples = [(tp, tp.split("/")[-1], float(val), val.ts) for tp, val in self.TopicValues.items()
+                   if isinstance(val, Reading)]
+        self.TopicValues["RefreshInterval"] = round(self.scheduler.update(samples), 1)
+        logging.debug(f"refresh interval {self.TopicValues['RefreshInterval']}s")
+
+    def isLiveOption(self, option:str, old, new) -> bool:
+        if "ADAPTIVE_REFRESH" == option:
+            # enabling or disabling adds or removes the interval entity
+            return bool(old) and bool(new)
+        return super().isLiveOption(option, old, new)
+
+    def applyConfig(self, options:set):
+        if "ADAPTIVE_REFRESH" in options:
+            adaptive = self.cfg.ADAPTIVE_REFRESH
+            self.scheduler.minimum = adaptive.get("MIN", 10)
+            self.scheduler.maximum = adaptive.get("MAX", 600)
+            self.scheduler.thresholds = adaptive.get("SLOPE", {"CO2": 50, "Temperature": 0.5})
+            self.scheduler.interval = self.scheduler.minimum
+
+    def getRefreshInterval(self) -> float:
+        if self.scheduler:
+            return self.scheduler.interval
+        return super().getRefreshInterval()
+
+    def setupSubscribeTopics(self) -> dict:
+        if self.cfg.get("REFRESH_COMMAND", False):
+            return {REFRESH_TOPIC: REFRESH_CMD}
+        return super().setupSubscribeTopics()
+
+    def _setupRefreshCommand(self):
+        """
+        option REFRESH_COMMAND: HASS button starting a poll & publish cycle now,
+        all commands received until the publish are served by one device read
+        """
+        self._refreshRQ = list() # monotonic receive times of pending refresh commands
+        self._refreshLock = threading.Lock()
+        self._publishedAt = 0.0 # monotonic time of the last publish cycle
+        if REFRESH_TOPIC in self.SUBSCRIBE_TOPICS:
+            self.CLIENT_TOPICS[REFRESH_TOPIC] = hass.HASS_COMPONENT_BUTTON
+            self.HASSCONFIGS[REFRESH_TOPIC] = {hass.HASS_CONFIG_ICON: "mdi:refresh",
+                                               hass.HASS_CONFIG_ENTITY_CATEGORY: "diagnostic"}
+
+    def onCommand(self, tp:str, payload:str):
+        if REFRESH_TOPIC != tp:
+            return super().onCommand(tp, payload)
+        now = time.monotonic()
+        with self._refreshLock:
+            if not self._refreshRQ and now - self._publishedAt < REFRESH_WINDOW:
+                REFRESH_SECONDS.observe(0) # served by the states just published
+                return
+            self._refreshRQ.append(now)
+            first = 1 == len(self._refreshRQ)
+        if first: # later commands are served by the pending cycle
+            self.wakeup()
+
+    def publish_cycle(self):
+        """ refresh commands: all states are published, unchanged values too """
+        with self._refreshLock:
+            pending = self._refreshRQ
+            self._refreshRQ = list()
+        if pending and self.is_connected():
+            self.publish_state_topics(force=True)
+            self.publish_metrics()
+        else:
+            super().publish_cycle()
+        now = time.monotonic()
+        with self._refreshLock:
+            self._publishedAt = now
+        for ts in pending:
+            REFRESH_SECONDS.observe(now - ts)
+        if pending:
+            logging.debug(f"{len(pending)} refresh command(s) served within {now - pending[0]:.3f}s")
+        if self._backfill is not None:
+            self._publishBackfill()
+
+    def _setupBackfill(self):
+        """
+        option BACKFILL: every decoded sensor reading is buffered and
+        published every INTERVAL [min] as one batch per sensor topic
+        on <baseTopic>/<topic>/backfill, see backfill.py & co2backfill.py
+        """
+        self._backfill = None
+        self._backfillPublished = time.monotonic()
+        self._backfillSeq = 0 # batch sequence, the importer drops redelivered batches
+        backfill = self.cfg.get("BACKFILL")
+        if not backfill:
+            return
+        self._backfill = BackfillBuffer(backfill.get("MAX_RECORDS", 100000))
+        for key, device in self.devices.items():
+            device.listeners.append(partial(self._onBackfillReading, key))
+
+    def _onBackfillReading(self, key, item, val, ts):
+        """ device listener: buffer a decoded sensor reading """
+        tp = ITEM_TOPICS.get(item)
+        if tp:
+            topic = f"{key}/{tp}" if key else tp
+            if topic in self.CLIENT_TOPICS:
+                self._backfill.append(topic, ts, Reading(item, val, ts).json())
+
+    def _publishBackfill(self, force=False):
+        """ publish the buffered readings if INTERVAL has expired, kept while disconnected """
+        now = time.monotonic()
+        if not self.is_connected() or \
+           (not force and now - self._backfillPublished < self.cfg.BACKFILL.get("INTERVAL", 15) * 60):
+            return
+        self._backfillPublished = now
+        dropped = self._backfill.dropped()
+        if dropped:
+            logging.warning(f"backfill buffer full, {dropped} readings dropped")
+        compress = self.cfg.BACKFILL.get("COMPRESS", False)
+        self._backfillSeq += 1
+        for tp, samples in self._backfill.take().items():
+            self.publish(f"{self.baseTopic}/{tp}/backfill", encodeBatch(samples, compress, self._backfillSeq), qos=1)
+            BACKFILL_SAMPLES.inc(len(samples))
+
+    def _setupAggregation(self):
+        """
+        option AGGREGATION: aggregate min/max/mean/percentile
+        of every decoded reading per publish window
+        """
+        self._aggregates = dict() # topic -> WindowStats
+        self._aggLock = threading.Lock()
+        agg = self.cfg.get("AGGREGATION")
+        if not agg:
+            return
+        for key, device in self.devices.items():
+            for tp in set(ITEM_TOPICS.values()):
+                topic = f"{key}/{tp}" if key else tp
+                if topic in self.CLIENT_TOPICS:
+                    self._aggregates[topic] = WindowStats(agg.get("PERCENTILE", 95))
+            device.listeners.append(partial(self._onReading, key))
+
+    def _onReading(self, key, item, val, ts):
+        """ device listener: aggregate a decoded reading """
+        tp = ITEM_TOPICS.get(item)
+        if tp:
+            agg = self._aggregates.get(f"{key}/{tp}" if key else tp)
+            if agg:
+                val = toUnit(item, val)
+                with self._aggLock:
+                    agg.update(val)
+
+    def getTopicAttributes(self, tp:str):
+        """
+        aggregates of the publish window, a new window starts,
+        None: no readings within the window
+        """
+        agg = self._aggregates.get(tp)
+        if agg is None:
+            return None
+        with self._aggLock:
+            attr = agg.result()
+            agg.reset()
+        return attr
+
+    def _getMqttDevice(self, key:str) -> dict:
+        """
+        HASS discovery device block of device key
+        """
+        suffix = f"_{key}" if key else ""
         mqtt_device = {
-            "identifiers": [f"{MQTT_CLIENT_ID}_{self._hostname}"],
+            "identifiers": [f"{MQTT_CLIENT_ID}_{self._hostname}{suffix}"],
             "manufacturer": "TFA Dostmann",
             "model": self.cfg.HW,
             "sw_version": self.version,
-            "name": f"{MQTT_CLIENT_ID}.{self._hostname}"
+            "name": f"{MQTT_CLIENT_ID}.{self._hostname}{suffix.replace('_', '.', 1)}"
         }
         return mqtt_device
 
+    def getHassDevice(self, tp:str, devId:dict) -> dict:
+        if "/" in tp:
+            return self._getMqttDevice(tp.split("/")[0])
+        return devId
+
+    def _topicDevice(self, tp:str) -> str:
+        """ device key of topic tp, "" in single device mode """
+        return tp.split("/")[0] if "/" in tp else ""
+
+    def isTopicAvailable(self, tp:str) -> bool:
+        """ topics of lost devices and item entities without a reading yet are unavailable """
+        if self._isItemTopic(tp) and not isinstance(self.TopicValues.get(tp), Reading):
+            return False
+        return not self.supervisor.isLost(self._topicDevice(tp))
+
+    def _isItemTopic(self, tp:str) -> bool:
+        """ topic of option ITEM_ENTITIES """
+        return tp.split("/")[-1] in self._itemTopics
+
+    def pollFailed(self) -> bool:
+        """ lost devices are recovered by the device supervisor """
+        logging.debug("no CO2 device available, waiting for the device")
+        return True
+
+    def _onDeviceRecovered(self, key:str, device:CO2Device):
+        """ device supervisor: device key was re-opened, resume publishing """
+        if self.cfg.get("CONTINUOUS_READ", False):
+            device.startReader()
+        if self.is_connected():
+            for tp, topic in self._avTopics.items():
+                if self._topicDevice(tp) == key:
+                    self.publish_avail(topic)
+        self.wakeup()
+
+    def _deviceLost(self, key:str, device:CO2Device):
+        """ read failure: mark the entities of device key unavailable """
+        self.supervisor.lost(key, device)
+        if self.is_connected():
+            for tp, topic in self._avTopics.items():
+                if self._topicDevice(tp) == key:
+                    self.publish_avail(topic, False)
+
     def poll(self):
         """
-        poll data from device
+        poll data from device(s), lost devices are skipped,
+        False: no device available
         """
-        return (self.device.receive(self.TopicValues))
+        if len(self.devices) == 1 and "" in self.devices:
+            if self.supervisor.isLost(""):
+                return False
+            if not self.device.receive(self.TopicValues):
+                self._deviceLost("", self.device)
+                return False
+        else:
+            polled = 0
+            for key, device in self.devices.items():
+                if self.supervisor.isLost(key):
+                    continue
+                values = {tp: self.TopicValues[f"{key}/{tp}"] for tp in ("Humidity",)
+                          if f"{key}/{tp}" in self.TopicValues}
+                if not device.receive(values):
+                    logging.error(f"polling device {key} has failed")
+                    self._deviceLost(key, device)
+                    continue
+                polled += 1
+                for tp, val in values.items():
+                    self.TopicValues[f"{key}/{tp}"] = val
+            if not polled:
+                return False
+        for item in self._itemEntities():
+            # latest value of the item code, read by the device anyway
+            for key, device in self.devices.items():
+                reading = device.items.get(item)
+                tp = f"{key}/{itemTopic(item)}" if key else itemTopic(item)
+                if reading is not None and tp in self.TopicValues:
+                    first = not isinstance(self.TopicValues[tp], Reading)
+                    self.TopicValues[tp] = reading
+                    if first and tp in self._avTopics and self.is_connected():
+                        # unavailable until the 1st reading of the item code
+                        self.publish_avail(self._avTopics[tp], self.isTopicAvailable(tp))
+        if self.cfg.get("DERIVED"):
+            self._updateDerived()
+        if self.scheduler:
+            self._updateScheduler()
+        return True
 
     def client_down(self):
+        if self._backfill is not None:
+            self._publishBackfill(force=True)
         super().client_down()
-        self.device.close()
+        for device in self.devices.values():
+            device.close()
+        for log in self._historyLogs:
+            log.close()
+
+def createTransport(record=None, replay=None, simulate=None, maxSpeed=False):
+    """
+    get the device transport selected by command line options
+    simulate: "plain" or "encrypted" frames
+    """
+    if replay:
+        return ReplayTransport(replay, realtime=not maxSpeed, loop=True)
+    if simulate:
+        transport = SimulatedTransport(encrypted="encrypted" == simulate,
+                                       rate=None if maxSpeed else 2)
+    else:
+        transport = HidTransport()
+    if record:
+        transport = RecordingTransport(record, transport)
+    return transport
+
+def probeDevice(cfgfile: str, duration: float, transport=None):
+    """
+    probe mode: read all device frames for duration [s] and
+    print frequency & value range of every item code
+    """
+    cfg = Config.load_json(cfgfile)
+    logging.basicConfig(level=LOG_LEVEL.get(cfg.get("LogLevel"), logging.INFO),
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%H:%M:%S')
+    device = CO2Device(transport)
+    if not device.open(int(cfg.VENDOR, 16), int(cfg.PRODUCT, 16)):
+        logging.error(f"access failure: vendor: {cfg.VENDOR} product: {cfg.PRODUCT}")
+        return -1
+    logging.info(f"probing device frames for {duration:g}s")
+    stats = device.probe(duration)
+    device.close()
+    print(f"frame mode: {device.frameMode}")
+    print("item  topic        frames  frames/min  min raw  max raw  min value  max value")
+    for item, (count, low, high, first, last) in sorted(stats.items()):
+        rate = count * 60 / (last - first) if last > first else 0
+        print(f"{item:#04x}  {ITEM_TOPICS.get(item, itemTopic(item)):<11}  {count:>6}  {rate:>10.1f}"
+              f"  {low:>7}  {high:>7}  {toUnit(item, low):>9.2f}  {toUnit(item, high):>9.2f}")
+    return 0
 
-def startClient(cfgfile: str, version: str):
+def startClient(cfgfile: str, version: str, useAsyncio: bool = False, transport=None):
     """
     generator help function to create MQTT client instance  & start it
     """
     cfg = Config.load_json(cfgfile)
-    logging.basicConfig(level=LOG_LEVEL[cfg.LogLevel],
+    logging.basicConfig(level=LOG_LEVEL.get(cfg.get("LogLevel"), logging.INFO),
                         format='%(asctime)s - %(levelname)s - %(message)s',
                         datefmt='%H:%M:%S')
-    client = Co2SensorClient(cfg, version)
+    errors = CONFIG_SCHEMA.validate(cfg)
+    for error in errors:
+        logging.error(f"{cfgfile}: {error}")
+    if errors:
+        logging.error("program exit(-1)")
+        exit(-1)
+    client = Co2SensorClient(cfg, version, transport)
+    client.cfgFile = cfgfile
     if "posix" in os.name and os.geteuid() == 0:
         logging.warning(f"It is not recommended to execute CO2MQTTSensor as root")
 
-    client.startup_client()
+    if useAsyncio:
+        client.startup_client_async()
+    else:
+        client.startup_client()
@@ -5,6 +5,7 @@ Created on 17.11.2023
 '''
 
 import json
+import logging
 
 class Dict(dict):
     """dot.notation access to dictionary attributes"""
@@ -43,6 +44,86 @@ class Config(object):
         return result
 
 
+class ConfigSchema(object):
+    """
+    config file schema, compiled once into a flat list of checks:
+    schema: option -> (types, required[, allowed values]) or nested schema dict
+    options starting with "//" are comments and not checked
+    """
+
+    def __init__(self, schema: dict):
+        self._checks = list() # (option path, types, required, allowed values)
+        self._compile(schema, ())
+
+    def _compile(self, schema: dict, path: tuple):
+        for key, rule in schema.items():
+            if isinstance(rule, dict):
+                self._checks.append((path + (key,), (dict,), True, None))
+                self._compile(rule, path + (key,))
+            else:
+                self._checks.append((path + (key,), rule[0], rule[1], rule[2] if len(rule) > 2 else None))
+
+    def validate(self, cfg: dict) -> list:
+        """ list of errors, empty if cfg is valid """
+        errors = list()
+        for path, types, required, allowed in self._checks:
+            value = cfg
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            name = ".".join(path)
+            if value is None:
+                if required:
+                    errors.append(f"option {name} is missing")
+            elif not isinstance(value, types) or (isinstance(value, bool) and bool not in types) \
+                    or (allowed is not None and value not in allowed):
+                errors.append(f"option {name}: invalid value {value!r}")
+        return errors
+
+
+""" Logging level: INFO, DEBUG, ERROR, WARN  """
+LOG_LEVEL = {
+    "INFO": logging.INFO,
+    "ERROR": logging.ERROR,
+    "WARN": logging.WARN,
+    "DEBUG": logging.DEBUG
+}
+
+NUMBER = (int, float)
+CONFIG_SCHEMA = ConfigSchema({
+    "LogLevel": ((str,), True, tuple(LOG_LEVEL)),
+    "HW": ((str,), True),
+    "VENDOR": ((str,), True),
+    "PRODUCT": ((str,), True),
+    "REFRESH_RATE": (NUMBER, True),
+    "CONTINUOUS_READ": ((bool,), False),
+    "MULTI_DEVICE": ((bool,), False),
+    "COMBINED_STATE": ((bool,), False),
+    "CONFIG_WATCH": ((bool,), False),
+    "STORE_FORWARD": ((dict,), False),
+    "METRICS": ((dict,), False),
+    "DISCOVERY_CACHE": ((str,), False),
+    "ADAPTIVE_REFRESH": ((dict,), False),
+    "DERIVED": ((dict,), False),
+    "AGGREGATION": ((dict,), False),
+    "PUBLISH_FILTER": ((dict,), False),
+    "HISTORY": ((dict,), False),
+    "ITEM_ENTITIES": ((list,), False),
+    "REFRESH_COMMAND": ((bool,), False),
+    "BACKFILL": ((dict,), False),
+    "MQTTBroker": {
+        "host": ((str,), True),
+        "port": ((int,), True),
+        "username": ((str,), True),
+        "password": ((str,), True),
+        "clientkeyfile": ((str,), True),
+        "clientcertfile": ((str,), True),
+        "reconnect_min": (NUMBER, False),
+        "reconnect_max": (NUMBER, False),
+        "protocol": ((int,), False)
+    }
+})
+
+
 class CheckConfig (object):
 
     @staticmethod
@@ -0,0 +1,27 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+import math
+
+""" Magnus formula coefficients over water, -45..60 °C """
+MAGNUS_A = 17.62
+MAGNUS_B = 243.12 # [°C]
+""" saturation vapour pressure at 0 °C [hPa] """
+MAGNUS_E0 = 6.112
+""" molar mass of water / universal gas constant * 100 [g*K/J] """
+WATER_VAPOUR_FACTOR = 216.74
+
+
+def dewPoint(temperature: float, humidity: float) -> float:
+    """ dew point [°C] of temperature [°C] & relative humidity [%] """
+    gamma = math.log(max(humidity, 0.01) / 100) + MAGNUS_A * temperature / (MAGNUS_B + temperature)
+    return MAGNUS_B * gamma / (MAGNUS_A - gamma)
+
+
+def absoluteHumidity(temperature: float, humidity: float) -> float:
+    """ absolute humidity [g/m³] of temperature [°C] & relative humidity [%] """
+    vapour = humidity / 100 * MAGNUS_E0 * math.exp(MAGNUS_A * temperature / (MAGNUS_B + temperature))
+    return WATER_VAPOUR_FACTOR * vapour / (273.15 + temperature)
@@ -0,0 +1,300 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+import hid
+import logging
+import os
+import random
+import re
+import struct
+import time
+
+""" capture file: sessions of magic + session key, then records (time offset [s], raw frame) """
+CAPTURE_MAGIC = b'CO2CAP\x01\x00'
+CAPTURE_RECORD = struct.Struct('<d8s')
+""" USB interface of a sysfs device path: <bus>-<port>[.<port>...]:<config>.<interface> """
+USB_INTERFACE = re.compile(r'^\d+-[\d.]+:\d+\.\d+$')
+
+
+def usbPortPath(path):
+    """
+    USB port path of a hidraw node, e.g. b'/dev/hidraw1' -> '1-1.2:1.0',
+    None if unknown. The port path is kept on reboot & re-plug into the same
+    port while hidraw nodes are renumbered
+    """
+    if isinstance(path, bytes):
+        path = path.decode("utf-8", "replace")
+    node = os.path.basename(path)
+    if not node.startswith("hidraw"):
+        return None
+    sysfs = os.path.realpath(f"/sys/class/hidraw/{node}/device")
+    ports = [part for part in sysfs.split("/") if USB_INTERFACE.match(part)]
+    return ports[-1] if ports else None
+
+
+
+class HidTransport(object):
+    """
+    default transport: USB HID devices via hidapi
+
+    a transport enumerates devices and opens them, the opened device
+    provides the hid.device methods used by CO2Device:
+    send_feature_report(), read(), close(),
+    get_manufacturer_string() and get_product_string()
+    a device with attribute sessionKey overrides the random key of CO2Device
+    """
+
+    def enumerate(self, vendor, product) -> list:
+        """ HID paths of all devices with vendor & product id """
+        return sorted(device["path"] for device in hid.enumerate(vendor, product))
+
+    def deviceIds(self, vendor, product) -> dict:
+        """ HID path -> stable device id: USB port path, else the HID path """
+        return {path: usbPortPath(path) or path for path in self.enumerate(vendor, product)}
+
+    def open(self, vendor, product, path=None):
+        dev = hid.device()
+        if path:
+            dev.open_path(path)
+        else:
+            dev.open(vendor, product)
+        return dev
+
+
+class RecordingTransport(object):
+    """
+    transport recording all raw frames of the inner transport's devices
+    with timing and session key to capture files: one file per device path,
+    a re-opened device appends a new session to its file
+    """
+
+    def __init__(self, filename: str, inner=None):
+        self.filename = filename
+        self.inner = inner if inner else HidTransport()
+        self._recorded = set() # capture files of this run
+
+    def enumerate(self, vendor, product) -> list:
+        return self.inner.enumerate(vendor, product)
+
+    def deviceIds(self, vendor, product) -> dict:
+        return self.inner.deviceIds(vendor, product)
+
+    def captureFile(self, path=None) -> str:
+        """ capture file of a device: filename, with device key suffix if opened by HID path """
+        if path is None:
+            return self.filename
+        from co2device import getDeviceKey # lazy: co2device uses this module
+        root, ext = os.path.splitext(self.filename)
+        return f"{root}-{getDeviceKey(path)}{ext}"
+
+    def open(self, vendor, product, path=None):
+        dev = self.inner.open(vendor, product, path)
+        filename = self.captureFile(path)
+        append = filename in self._recorded
+        self._recorded.add(filename)
+        return RecordingDevice(dev, filename, append)
+
+
+class RecordingDevice(object):
+
+    def __init__(self, dev, filename: str, append=False):
+        self._dev = dev
+        self._file = open(filename, "ab" if append else "wb")
+        self._start = None
+        logging.info(f"recording device frames to {filename}{', new session' if append else ''}")
+
+    def send_feature_report(self, data):
+        # the session key is sent once when the device is opened
+        if self._start is None:
+            self._file.write(CAPTURE_MAGIC + bytes(data[1:9]))
+            self._start = time.monotonic()
+        return self._dev.send_feature_report(data)
+
+    def read(self, size, timeout_ms):
+        raw = self._dev.read(size, timeout_ms)
+        if len(raw) == 8 and self._start is not None:
+            self._file.write(CAPTURE_RECORD.pack(time.monotonic() - self._start, bytes(raw)))
+        return raw
+
+    def close(self):
+        self._file.close()
+        self._dev.close()
+
+    def get_manufacturer_string(self):
+        return self._dev.get_manufacturer_string()
+
+    def get_product_string(self):
+        return self._dev.get_product_string()
+
+
+class ReplayTransport(object):
+    """
+    transport replaying a capture file of RecordingTransport, all sessions in order,
+    realtime: keep the recorded frame timing, else replay at max. speed
+    loop: restart at end of capture, else read() returns no data at the end
+    """
+
+    def __init__(self, filename: str, realtime=True, loop=False):
+        self.filename = filename
+        self.realtime = realtime
+        self.loop = loop
+
+    def enumerate(self, _vendor, _product) -> list:
+        return [b"replay"]
+
+    def deviceIds(self, vendor, product) -> dict:
+        return {path: path for path in self.enumerate(vendor, product)}
+
+    def open(self, _vendor, _product, _path=None):
+        return ReplayDevice(self.filename, self.realtime, self.loop)
+
+
+class ReplayDevice(object):
+
+    def __init__(self, filename: str, realtime=True, loop=False):
+        with open(filename, "rb") as f:
+            data = f.read()
+        if data[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            raise IOError(f"{filename} is no CO2 device capture file")
+        self.sessionKey = None
+        self._frames = list()
+        offs = 0
+        base = 0.0 # time offset of the current session
+        while offs + CAPTURE_RECORD.size <= len(data):
+            if data[offs:offs + len(CAPTURE_MAGIC)] == CAPTURE_MAGIC:
+                key = list(data[offs + len(CAPTURE_MAGIC):offs + CAPTURE_RECORD.size])
+                if self.sessionKey is None:
+                    self.sessionKey = key
+                base = self._frames[-1][0] if self._frames else 0.0
+            else:
+                ts, raw = CAPTURE_RECORD.unpack_from(data, offs)
+                if key != self.sessionKey:
+                    raw = self._rekey(raw, key)
+                self._frames.append((base + ts, raw))
+            offs += CAPTURE_RECORD.size
+        self._realtime = realtime
+        self._loop = loop
+        self._pos = 0
+        self._start = time.monotonic()
+        logging.info(f"replaying {len(self._frames)} device frames of {filename}")
+
+    def _rekey(self, raw: bytes, key: list) -> bytes:
+        """ frame of a later session encrypted by the key of the 1st session, the replay key """
+        import co2device # lazy: co2device uses this module
+        if co2device.isValidFrame(raw):
+            return raw # plain frame
+        data = co2device.decrypt(list(raw), key)
+        if not co2device.isValidFrame(data):
+            return raw # corrupt frame
+        return bytes(co2device.encrypt(data, self.sessionKey))
+
+    def send_feature_report(self, data):
+        return len(data)
+
+    def read(self, _size, _timeout_ms):
+        if self._pos >= len(self._frames):
+            if not self._loop or not self._frames:
+                return list()
+            self._pos = 0
+            self._start = time.monotonic()
+        ts, raw = self._frames[self._pos]
+        self._pos += 1
+        if self._realtime:
+            delay = self._start + ts - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return list(raw)
+
+    def close(self):
+        self._frames = list()
+
+    def get_manufacturer_string(self):
+        return "replay"
+
+    def get_product_string(self):
+        return "CO2 device capture"
+
+
+class SimulatedTransport(object):
+    """
+    transport simulating CO2 devices by synthetic frames,
+    encrypted: frames encrypted by the session key like older devices
+    rate: frames per second, None: max. speed
+    """
+
+    def __init__(self, encrypted=False, rate=None, humidity=True):
+        self.encrypted = encrypted
+        self.rate = rate
+        self.humidity = humidity
+
+    def enumerate(self, _vendor, _product) -> list:
+        return [b"sim0"]
+
+    def deviceIds(self, vendor, product) -> dict:
+        return {path: path for path in self.enumerate(vendor, product)}
+
+    def open(self, _vendor, _product, _path=None):
+        return SimulatedDevice(self.encrypted, self.rate, self.humidity)
+
+
+class SimulatedDevice(object):
+
+    def __init__(self, encrypted=False, rate=None, humidity=True):
+        import co2device # lazy: co2device uses this module
+        self._co2device = co2device
+        self._encrypted = encrypted
+        self._interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._key = None
+        self._co2 = 600.0
+        self._temp = 21.0
+        self._hum = 45.0
+        self._items = [co2device.eCO2, co2device.eTemp, co2device.eUnkown1, co2device.eCO2_2]
+        if humidity:
+            self._items.append(co2device.eHum1)
+        self._pos = 0
+
+    def send_feature_report(self, data):
+        self._key = list(data[1:9])
+        return len(data)
+
+    def _value(self, item) -> int:
+        """ random walk of the simulated sensor values, raw 16 bit device units """
+        dev = self._co2device
+        if dev.eCO2 == item or dev.eCO2_2 == item:
+            self._co2 = min(5000.0, max(400.0, self._co2 + random.uniform(-5, 5)))
+            return int(self._co2)
+        if dev.eTemp == item:
+            self._temp = min(35.0, max(10.0, self._temp + random.uniform(-0.05, 0.05)))
+            return int((self._temp + 273.15) * 16)
+        if dev.eHum1 == item:
+            self._hum = min(90.0, max(20.0, self._hum + random.uniform(-0.2, 0.2)))
+            return int(self._hum * 100)
+        return 0
+
+    def read(self, _size, _timeout_ms):
+        if self._interval:
+            self._next += self._interval
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        item = self._items[self._pos]
+        self._pos = (self._pos + 1) % len(self._items)
+        val = self._value(item)
+        frame = [item, val >> 8, val & 0xff]
+        frame += [sum(frame) & 0xff, 0x0d, 0, 0, 0]
+        if self._encrypted:
+            frame = self._co2device.encrypt(frame, self._key)
+        return frame
+
+    def close(self):
+        pass
+
+    def get_manufacturer_string(self):
+        return "simulation"
+
+    def get_product_string(self):
+        return "CO2 device simulation"
@@ -0,0 +1,181 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+HISTORY_MAGIC = b'CO2H'
+HISTORY_VERSION = 1
+""" segment header: magic, version """
+HISTORY_HEADER = struct.Struct('<4sI')
+""" record: timestamp [s since epoch], item code, raw 16 bit value """
+HISTORY_RECORD = struct.Struct('<dBxH')
+HISTORY_SUFFIX = ".co2h"
+DAY = 86400
+
+
+def segmentName(ts: float) -> str:
+    """ day segment file name of timestamp ts (UTC day) """
+    return time.strftime("%Y%m%d", time.gmtime(ts)) + HISTORY_SUFFIX
+
+
+class HistoryLog(object):
+    """
+    append-only log of decoded device readings in day segment files,
+    records are buffered and written in batches of flushRecords records
+    or at least every flushInterval [s]. keepDays > 0 removes older segments
+    """
+
+    def __init__(self, path: str, flushRecords: int = 256, flushInterval: float = 60, keepDays: int = 0):
+        self.path = path
+        self.flushRecords = flushRecords
+        self.flushInterval = flushInterval
+        self.keepDays = keepDays
+        self._buf = bytearray()
+        self._bufSegment = None
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, ts: float, item: int, raw: int):
+        segment = segmentName(ts)
+        with self._lock:
+            if segment != self._bufSegment:
+                self._flush()
+                self._bufSegment = segment
+                self._expire(ts)
+            self._buf += HISTORY_RECORD.pack(ts, item, raw)
+            if len(self._buf) >= self.flushRecords * HISTORY_RECORD.size or \
+               time.monotonic() - self._flushed >= self.flushInterval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+    def _flush(self):
+        self._flushed = time.monotonic()
+        if not self._buf:
+            return
+        filename = os.path.join(self.path, self._bufSegment)
+        try:
+            with open(filename, "ab") as f:
+                if f.tell() == 0:
+                    f.write(HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION))
+                f.write(self._buf)
+        except OSError as e:
+            logging.error(f"history log {filename}: {str(e)}, {len(self._buf) // HISTORY_RECORD.size} readings dropped")
+        self._buf = bytearray()
+
+    def _expire(self, ts: float):
+        if self.keepDays <= 0:
+            return
+        oldest = segmentName(ts - self.keepDays * DAY)
+        for name in os.listdir(self.path):
+            if name.endswith(HISTORY_SUFFIX) and name < oldest:
+                os.remove(os.path.join(self.path, name))
+                logging.info(f"history log segment {name} removed")
+
+
+class HistoryReader(object):
+    """
+    time range queries of a history log directory, segments are memory-mapped,
+    the first record of a range is found by binary search
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def segments(self, start: float, end: float) -> list:
+        """ segment files of the time range [start, end] """
+        first, last = segmentName(start), segmentName(end)
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                      if name.endswith(HISTORY_SUFFIX) and first <= name <= last)
+
+    def query(self, start: float, end: float, items=None):
+        """ generator of the readings (timestamp, item, raw value) in [start, end] """
+        for filename in self.segments(start, end):
+            with open(filename, "rb") as f:
+                if os.fstat(f.fileno()).st_size <= HISTORY_HEADER.size:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    magic, _version = HISTORY_HEADER.unpack_from(data, 0)
+                    if magic != HISTORY_MAGIC:
+                        logging.warning(f"{filename} is no history log segment")
+                        continue
+                    yield from self._records(data, start, end, items)
+
+    @staticmethod
+    def _records(data, start: float, end: float, items):
+        size = HISTORY_RECORD.size
+        count = (len(data) - HISTORY_HEADER.size) // size
+        lo, hi = 0, count
+        while lo < hi: # 1st record with timestamp >= start
+            mid = (lo + hi) // 2
+            if HISTORY_RECORD.unpack_from(data, HISTORY_HEADER.size + mid * size)[0] < start:
+                lo = mid + 1
+            else:
+                hi = mid
+        for offs in range(HISTORY_HEADER.size + lo * size, HISTORY_HEADER.size + count * size, size):
+            record = HISTORY_RECORD.unpack_from(data, offs)
+            if record[0] > end:
+                return
+            if items is None or record[1] in items:
+                yield record
+
+
+def downsample(records, step: float, convert=None):
+    """
+    generator of the means (bucket timestamp, item, mean value, count)
+    of time ordered records per item and time bucket of step [s],
+    convert(item, raw): unit conversion of the raw values
+    """
+    bucket = None
+    sums = dict() # item -> [sum, count]
+    for ts, item, raw in records:
+        current = ts - ts % step
+        if current != bucket:
+            for it, (total, num) in sums.items():
+                yield bucket, it, total / num, num
+            bucket = current
+            sums = dict()
+        value = convert(item, raw) if convert else raw
+        acc = sums.setdefault(item, [0.0, 0])
+        acc[0] += value
+        acc[1] += 1
+    for it, (total, num) in sums.items():
+        yield bucket, it, total / num, num
+
+
+def export(rows, out, fmt: str = "csv", itemName=hex):
+    """
+    write rows (timestamp, item, value[, count]) as CSV or JSON array to out,
+    row by row without loading the history into memory
+    """
+    first = True
+    for row in rows:
+        ts = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(row[0]))
+        value = round(row[2], 2)
+        if "json" == fmt:
+            record = {"time": ts, "item": itemName(row[1]), "value": value}
+            if len(row) > 3:
+                record["count"] = row[3]
+            out.write(("[" if first else ",\n") + json.dumps(record))
+        else:
+            if first:
+                out.write("time,item,value" + (",count" if len(row) > 3 else "") + "\n")
+            out.write(f"{ts},{itemName(row[1])},{value}" + (f",{row[3]}" if len(row) > 3 else "") + "\n")
+        first = False
+    if "json" == fmt:
+        out.write("[]\n" if first else "]\n")
@@ -0,0 +1,191 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+import bisect
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _labelStr(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter(object):
+    """ monotonic counter, optionally with labels """
+
+    registry = None # owning registry, nothing is recorded while it is disabled
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = dict() # sorted label tuple -> value
+        self._lock = threading.Lock()
+
+    def inc(self, num=1, **labels):
+        if self.registry is not None and not self.registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + num
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_labelStr(k)} {v}" for k, v in self._values.items()]
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            if not self._values:
+                return 0
+            if list(self._values) == [()]:
+                return self._values[()]
+            return {",".join(f"{k}={v}" for k, v in key): val for key, val in self._values.items()}
+
+
+class Gauge(object):
+    """ current value, read by a callback function at scrape time """
+
+    def __init__(self, name: str, help: str, func):
+        self.name = name
+        self.help = help
+        self._func = func
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.snapshot()}"]
+
+    def snapshot(self):
+        try:
+            return self._func()
+        except Exception:
+            return 0
+
+
+class Histogram(object):
+    """ cumulative histogram with fixed bucket upper bounds """
+
+    registry = None # owning registry, nothing is recorded while it is disabled
+
+    def __init__(self, name: str, help: str, buckets: tuple):
+        self.name = name
+        self.help = help
+        self._buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        if self.registry is not None and not self.registry.enabled:
+            return
+        idx = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            total = 0
+            for bound, count in zip(self._buckets, self._counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {total}')
+            total += self._counts[-1]
+            lines.append(f'{self.name}_bucket{{le="+Inf"}} {total}')
+            lines.append(f"{self.name}_sum {self._sum}")
+            lines.append(f"{self.name}_count {total}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            count = sum(self._counts)
+            return {"count": count, "sum": round(self._sum, 6),
+                    "buckets": {f"{b:g}": c for b, c in zip(self._buckets, self._counts)}}
+
+
+class Registry(object):
+    """
+    named metrics, rendered in Prometheus text format or as JSON snapshot.
+    Disabled by default: counters & histograms are not recorded and the
+    instrumented modules skip their timing unless enable() was called
+    """
+
+    def __init__(self):
+        self._metrics = dict()
+        self._lock = threading.Lock()
+        self.enabled = False
+
+    def enable(self):
+        self.enabled = True
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args)
+                self._metrics[name].registry = self
+            return self._metrics[name]
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str, buckets: tuple) -> Histogram:
+        return self._get(Histogram, name, help, buckets)
+
+    def gauge(self, name: str, help: str, func) -> Gauge:
+        with self._lock:
+            self._metrics[name] = Gauge(name, help, func)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.items())
+        return {name: m.snapshot() for name, m in metrics}
+
+
+""" process wide registry used by all instrumented modules """
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        if self.path.endswith("json"):
+            body = json.dumps(REGISTRY.snapshot()).encode("utf-8")
+            ctype = "application/json"
+        else:
+            body = REGISTRY.render().encode("utf-8")
+            ctype = "text/plain; version=0.0.4"
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass # no access log
+
+
+def startMetricsServer(port: int, bind: str = "127.0.0.1"):
+    """
+    serve REGISTRY in Prometheus text format on http://<bind>:<port>/metrics
+    """
+    server = ThreadingHTTPServer((bind, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"metrics endpoint http://{bind}:{port}/metrics")
+    return server
@@ -0,0 +1,45 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+
+class AdaptiveScheduler(object):
+    """
+    adaptive poll & publish interval driven by the rate of change:
+    the interval drops to minimum when the slope of a value exceeds its
+    threshold [unit/min], otherwise it backs off exponentially to maximum.
+    slopes are taken over at least the minimum interval to ignore noise
+    """
+
+    def __init__(self, minimum: float, maximum: float, thresholds: dict, factor: float = 2):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.thresholds = thresholds # value name -> slope threshold [unit/min]
+        self.factor = factor
+        self.interval = minimum
+        self._last = dict() # key -> (value, monotonic timestamp) of the last poll
+
+    def exceeds(self, key: str, name: str, value: float, ts: float) -> bool:
+        """ True when the slope of key since the last poll exceeds the threshold of name """
+        threshold = self.thresholds.get(name)
+        last = self._last.get(key)
+        if not threshold or last is None:
+            return False
+        return abs(value - last[0]) * 60 / max(ts - last[1], self.minimum) > threshold
+
+    def update(self, samples: list) -> float:
+        """
+        samples (key, name, value, monotonic timestamp) of a poll,
+        returns the next interval [s]
+        """
+        fast = False
+        for key, name, value, ts in samples:
+            fast = self.exceeds(key, name, value, ts) or fast
+            self._last[key] = (value, ts)
+        if fast:
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.maximum, self.interval * self.factor)
+        return self.interval
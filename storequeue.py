@@ -0,0 +1,102 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+QUEUE_MAGIC = b'CO2Q'
+QUEUE_VERSION = 1
+""" header: magic, version, head offset, tail offset """
+QUEUE_HEADER = struct.Struct('<4sIQQ')
+""" record: timestamp [s since epoch], topic key, value """
+QUEUE_RECORD = struct.Struct('<dId')
+QUEUE_CHUNK = 64 * 1024
+
+
+def topicKey(tp: str) -> int:
+    """ stable 32 bit key of a topic name stored in the queue records """
+    return zlib.crc32(tp.encode('utf-8'))
+
+
+class StoreQueue(object):
+    """
+    persistent append-only FIFO of timestamped readings
+
+    fixed size binary records in a memory-mapped file, the file grows in
+    chunks and is reset when all records have been consumed. head & tail
+    offsets are kept in the file header hence the queue survives restarts
+    """
+
+    def __init__(self, path: str, maxRecords: int = 100000):
+        self.path = path
+        self.maxRecords = maxRecords
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self._fd).st_size
+        if size < QUEUE_HEADER.size:
+            os.ftruncate(self._fd, QUEUE_CHUNK)
+        self._map = mmap.mmap(self._fd, 0)
+        magic, version, self._head, self._tail = QUEUE_HEADER.unpack_from(self._map, 0)
+        if magic != QUEUE_MAGIC or version != QUEUE_VERSION or \
+           not QUEUE_HEADER.size <= self._head <= self._tail <= len(self._map):
+            if magic != bytes(4):
+                logging.warning(f"store queue {path}: invalid header, queue reset")
+            self._reset()
+        elif len(self):
+            logging.info(f"store queue {path}: {len(self)} readings pending")
+
+    def __len__(self):
+        return (self._tail - self._head) // QUEUE_RECORD.size
+
+    def _writeHeader(self):
+        QUEUE_HEADER.pack_into(self._map, 0, QUEUE_MAGIC, QUEUE_VERSION, self._head, self._tail)
+
+    def _reset(self):
+        self._head = self._tail = QUEUE_HEADER.size
+        if len(self._map) > QUEUE_CHUNK:
+            self._resize(QUEUE_CHUNK)
+        self._writeHeader()
+
+    def _resize(self, size: int):
+        self._map.flush()
+        self._map.close()
+        os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, 0)
+
+    def append(self, ts: float, tp: str, value: float) -> bool:
+        if len(self) >= self.maxRecords:
+            return False
+        if self._tail + QUEUE_RECORD.size > len(self._map):
+            self._resize(len(self._map) + QUEUE_CHUNK)
+        QUEUE_RECORD.pack_into(self._map, self._tail, ts, topicKey(tp), value)
+        self._tail += QUEUE_RECORD.size
+        self._writeHeader()
+        return True
+
+    def peek(self, num: int, skip: int = 0) -> list:
+        """ get up to num oldest records (timestamp, topic key, value) after skip records """
+        start = min(self._tail, self._head + skip * QUEUE_RECORD.size)
+        end = min(self._tail, start + num * QUEUE_RECORD.size)
+        return [QUEUE_RECORD.unpack_from(self._map, offs)
+                for offs in range(start, end, QUEUE_RECORD.size)]
+
+    def consume(self, num: int):
+        """ remove num oldest records """
+        self._head = min(self._tail, self._head + num * QUEUE_RECORD.size)
+        if self._head == self._tail:
+            self._reset()
+        else:
+            self._writeHeader()
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        os.close(self._fd)
@@ -0,0 +1,106 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+import logging
+import threading
+import time
+from co2device import getDeviceKey
+from metrics import REGISTRY
+
+SCAN_INTERVAL = 0.5 # [s] min. interval of device enumerations
+
+DEVICE_LOSSES = REGISTRY.counter("co2_device_lost_total", "device read or open failures by device key")
+DEVICE_REOPENS = REGISTRY.counter("co2_device_reopens_total", "re-opened devices by result")
+
+
+class DeviceSupervisor(object):
+    """
+    hot-plug supervisor of lost devices: a background thread watches
+    the cached device enumeration for the vendor & product id and re-opens
+    a lost device with a fresh session key as soon as it reappears.
+    onRecovered(key, device) is called after a successful re-open
+    """
+
+    def __init__(self, transport, vendor: int, product: int, onRecovered, scanInterval: float = SCAN_INTERVAL):
+        self._transport = transport
+        self.vendor = vendor
+        self.product = product
+        self.onRecovered = onRecovered
+        self.scanInterval = scanInterval
+        self._lost = dict() # device key -> lost CO2Device
+        self._lock = threading.Lock()
+        self._ids = dict() # HID path -> stable device id
+        self._scanned = 0.0
+        self._thread = None
+
+    def enumerate(self) -> dict:
+        """
+        HID path -> stable device id of the vendor & product id,
+        rescanned at most every scanInterval
+        """
+        now = time.monotonic()
+        if now - self._scanned >= self.scanInterval:
+            self._scanned = now
+            try:
+                self._ids = self._transport.deviceIds(self.vendor, self.product)
+            except OSError as e:
+                logging.debug(f"device enumeration has failed: {str(e)}")
+                self._ids = dict()
+        return self._ids
+
+    def isLost(self, key: str) -> bool:
+        with self._lock:
+            return key in self._lost
+
+    def hasLost(self) -> bool:
+        with self._lock:
+            return len(self._lost) > 0
+
+    def lost(self, key: str, device):
+        """ take over a device after a read or open failure """
+        device.close()
+        with self._lock:
+            if key in self._lost:
+                return
+            self._lost[key] = device
+            start = self._thread is None
+            if start:
+                self._thread = threading.Thread(target=self._run, name="co2supervisor", daemon=True)
+        DEVICE_LOSSES.inc(device=key or "default")
+        logging.warning(f"CO2 device {key or '(default)'} lost, waiting for the device to reappear")
+        if start:
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.scanInterval)
+            with self._lock:
+                if not self._lost:
+                    self._thread = None
+                    break
+                lost = list(self._lost.items())
+            ids = self.enumerate()
+            if not ids:
+                continue
+            paths = {getDeviceKey(deviceId): path for path, deviceId in ids.items()}
+            for key, device in lost:
+                # single device mode: any device, else the device of the same stable id,
+                # its hidraw node may have changed
+                path = None
+                if device.path is not None:
+                    path = paths.get(key)
+                    if path is None:
+                        continue
+                if device.reopen(self.vendor, self.product, path):
+                    DEVICE_REOPENS.inc(result="ok")
+                    logging.info(f"CO2 device {key or '(default)'} re-opened")
+                    with self._lock:
+                        del self._lost[key]
+                    self.onRecovered(key, device)
+                else:
+                    DEVICE_REOPENS.inc(result="failed")
+                    device.close()
+        logging.debug("device supervisor stopped")
@@ -0,0 +1,54 @@
+import json
+import zlib
+
+import pytest
+
+from backfill import encodeBatch, decodeBatch, decodeReplay, BackfillBuffer
+
+SAMPLES = [(1760000000.125, 612), (1760000010.5, 615.5), (1760000071.0, 620)]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(compress):
+    seq, samples = decodeBatch(encodeBatch(SAMPLES, compress, seq=17))
+    assert seq == 17
+    assert [v for _ts, v in samples] == [v for _ts, v in SAMPLES]
+    for (ts, _v), (ref, _r) in zip(samples, SAMPLES):
+        assert ts == pytest.approx(ref, abs=0.001)
+
+
+def test_empty_batch():
+    assert decodeBatch(encodeBatch([])) == (0, [])
+
+
+@pytest.mark.parametrize("payload", [
+    b"",
+    b"{not json",
+    b'{"t0": 1, "dt": [0]}',
+    b'{"t0": 1, "dt": [0], "v": ["x"]}',
+    b'{"t0": 1, "dt": [0], "v": [true]}',
+    b'{"t0": "1", "dt": [0], "v": [1]}',
+    encodeBatch(SAMPLES, True)[:-4],
+    bytes((0x78, 0x9c)) + b"garbage",
+])
+def test_corrupt_batch(payload):
+    with pytest.raises((ValueError, KeyError, TypeError, zlib.error)):
+        decodeBatch(payload)
+
+
+def test_replay():
+    assert decodeReplay(json.dumps({"co2": 612, "timestamp": 1760000000}).encode()) == (None, [(1760000000, 612)])
+    with pytest.raises(ValueError):
+        decodeReplay(json.dumps({"co2": 612, "temp": 20, "timestamp": 1760000000}).encode())
+
+
+def test_buffer_drops_oldest():
+    buffer = BackfillBuffer(maxRecords=3)
+    for i in range(4):
+        buffer.append("co2", i, i)
+    buffer.append("temp", 9, 9)
+    assert buffer.dropped() == 2
+    samples = buffer.take()
+    assert list(samples["co2"]) == [(2, 2), (3, 3)]
+    assert list(samples["temp"]) == [(9, 9)]
+    assert len(buffer) == 0
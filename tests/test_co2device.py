@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from co2device import decrypt, encrypt, Decryptor, np
+
+
+def frames(num, seed=1):
+    rnd = random.Random(seed)
+    return [bytes(rnd.randrange(256) for _ in range(8)) for _ in range(num)]
+
+
+@pytest.fixture
+def key():
+    return list(random.Random(7).randbytes(8))
+
+
+def test_decryptor_equals_reference(key):
+    decryptor = Decryptor(key)
+    for data in frames(500):
+        assert decryptor.decrypt(data) == decrypt(data, key)
+
+
+def test_encrypt_is_inverse(key):
+    for data in frames(100):
+        assert decrypt(encrypt(list(data), key), key) == list(data)
+
+
+@pytest.mark.parametrize("useNumpy", [False, pytest.param(True, marks=pytest.mark.skipif(np is None, reason="NumPy is not installed"))])
+def test_decrypt_batch_equals_reference(key, useNumpy):
+    data = frames(300)
+    out = Decryptor(key).decryptBatch(b"".join(data), useNumpy)
+    assert out == b"".join(bytes(decrypt(frame, key)) for frame in data)
+
+
+def test_decrypt_batch_partial_frame(key):
+    with pytest.raises(ValueError):
+        Decryptor(key).decryptBatch(bytes(12))
@@ -0,0 +1,31 @@
+from config import ConfigSchema
+
+SCHEMA = ConfigSchema({
+    "LogLevel": ((str,), True, ("INFO", "DEBUG")),
+    "REFRESH_RATE": ((int, float), True),
+    "CONTINUOUS_READ": ((bool,), False),
+    "MQTTBroker": {
+        "host": ((str,), True),
+        "port": ((int,), False),
+    },
+})
+
+
+def test_valid():
+    assert SCHEMA.validate({"LogLevel": "INFO", "REFRESH_RATE": 5, "//CONTINUOUS_READ": "x",
+                            "MQTTBroker": {"host": "localhost"}}) == []
+
+
+def test_errors():
+    errors = SCHEMA.validate({"LogLevel": "TRACE", "REFRESH_RATE": True,
+                              "CONTINUOUS_READ": 1, "MQTTBroker": {"port": "1883"}})
+    assert errors == ["option LogLevel: invalid value 'TRACE'",
+                      "option REFRESH_RATE: invalid value True",
+                      "option CONTINUOUS_READ: invalid value 1",
+                      "option MQTTBroker.host is missing",
+                      "option MQTTBroker.port: invalid value '1883'"]
+
+
+def test_missing_section():
+    assert SCHEMA.validate({"LogLevel": "INFO", "REFRESH_RATE": 5}) == [
+        "option MQTTBroker is missing", "option MQTTBroker.host is missing"]
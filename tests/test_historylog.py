@@ -0,0 +1,17 @@
+from historylog import HistoryLog, HistoryReader, DAY
+
+T0 = 1760000000.0
+
+
+def test_query_across_segments(tmp_path):
+    log = HistoryLog(str(tmp_path), flushRecords=4)
+    records = [(T0 + i * 3600, 0x50 if i % 2 else 0x42, 400 + i) for i in range(48)]
+    for record in records:
+        log.append(*record)
+    log.close()
+
+    reader = HistoryReader(str(tmp_path))
+    assert len(reader.segments(T0, T0 + 2 * DAY)) >= 2
+    assert list(reader.query(T0, T0 + 2 * DAY)) == records
+    assert list(reader.query(T0 + 10 * 3600, T0 + 12 * 3600)) == records[10:13]
+    assert list(reader.query(T0, T0 + 2 * DAY, {0x50})) == [r for r in records if r[1] == 0x50]
@@ -0,0 +1,55 @@
+from storequeue import StoreQueue, topicKey, QUEUE_CHUNK, QUEUE_RECORD
+
+
+def test_fifo_and_reopen(tmp_path):
+    path = str(tmp_path / "queue")
+    queue = StoreQueue(path)
+    for i in range(10):
+        assert queue.append(1000.0 + i, "co2", i)
+    queue.consume(3)
+    queue.close()
+
+    queue = StoreQueue(path)
+    assert len(queue) == 7
+    assert queue.peek(2) == [(1003.0, topicKey("co2"), 3), (1004.0, topicKey("co2"), 4)]
+    assert [r[2] for r in queue.peek(2, skip=5)] == [8, 9]
+    queue.close()
+
+
+def test_wraparound_resets_file(tmp_path):
+    path = str(tmp_path / "queue")
+    queue = StoreQueue(path)
+    num = 2 * QUEUE_CHUNK // QUEUE_RECORD.size # grows the file by two chunks
+    for i in range(num):
+        queue.append(float(i), "temp", i)
+    assert len(queue) == num
+    queue.consume(num - 1)
+    assert queue.peek(5) == [(float(num - 1), topicKey("temp"), num - 1)]
+    queue.consume(5) # more than pending
+    assert len(queue) == 0
+    assert (tmp_path / "queue").stat().st_size == QUEUE_CHUNK
+
+    # queue starts at the head again after the reset
+    queue.append(1.5, "temp", 42)
+    queue.close()
+    queue = StoreQueue(path)
+    assert queue.peek(5) == [(1.5, topicKey("temp"), 42)]
+    queue.close()
+
+
+def test_max_records(tmp_path):
+    queue = StoreQueue(str(tmp_path / "queue"), maxRecords=3)
+    assert all(queue.append(i, "co2", i) for i in range(3))
+    assert not queue.append(3, "co2", 3)
+    assert len(queue) == 3
+    queue.close()
+
+
+def test_invalid_header_resets(tmp_path):
+    path = tmp_path / "queue"
+    path.write_bytes(b"junk" * 100)
+    queue = StoreQueue(str(path))
+    assert len(queue) == 0
+    queue.append(1, "co2", 1)
+    assert len(queue) == 1
+    queue.close()
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from windowstats import P2Quantile, WindowStats
+
+
+def sortedQuantile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+@pytest.mark.parametrize("p", [0.5, 0.9, 0.95])
+@pytest.mark.parametrize("dist", ["uniform", "gauss"])
+def test_p2_against_sorted_sample(p, dist):
+    rnd = random.Random(42)
+    draw = (lambda: rnd.uniform(400, 2000)) if dist == "uniform" else (lambda: rnd.gauss(800, 50))
+    values = [draw() for _ in range(20000)]
+    quantile = P2Quantile(p)
+    for x in values:
+        quantile.update(x)
+    spread = sortedQuantile(values, 0.99) - sortedQuantile(values, 0.01)
+    assert quantile.value() == pytest.approx(sortedQuantile(values, p), abs=0.01 * spread)
+
+
+def test_p2_few_values():
+    quantile = P2Quantile(0.5)
+    assert quantile.value() is None
+    for x in (3, 1, 2):
+        quantile.update(x)
+    assert quantile.value() == 2
+
+
+def test_window_stats_empty():
+    stats = WindowStats()
+    assert stats.result() is None
+    stats.update(1)
+    assert stats.result() is not None
@@ -0,0 +1,137 @@
+'''
+Created on 17.10.2026
+
+@author: irimi
+'''
+
+from collections import deque
+
+
+class P2Quantile(object):
+    """
+    approximate percentile, P-square algorithm by Jain & Chlamtac:
+    O(1) memory & time per value, 5 markers track the quantile estimate
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self._init = list()
+        self._q = None
+
+    def update(self, x: float):
+        if self._q is None:
+            self._init.append(x)
+            if len(self._init) == 5:
+                p = self.p
+                self._q = sorted(self._init)
+                self._n = [1, 2, 3, 4, 5]
+                self._np = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+                self._dn = [0, p / 2, p, (1 + p) / 2, 1]
+            return
+
+        q, n = self._q, self._n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._np[i] += self._dn[i]
+
+        for i in (1, 2, 3):
+            d = self._np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        if self._q is None:
+            if not self._init:
+                return None
+            values = sorted(self._init)
+            return values[min(len(values) - 1, int(self.p * len(values)))]
+        return self._q[2]
+
+
+class WindowStats(object):
+    """
+    incremental min, max, mean & approximate percentile of a window,
+    O(1) per value, reset() starts the next window
+    """
+
+    def __init__(self, percentile: float = 95):
+        self.percentile = percentile
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._sum = 0.0
+        self.min = None
+        self.max = None
+        self._quantile = P2Quantile(self.percentile / 100)
+
+    def update(self, value: float):
+        self.count += 1
+        self._sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self._quantile.update(value)
+
+    def result(self):
+        """ aggregates of the window, None: no values """
+        if not self.count:
+            return None
+        return {"count": self.count,
+                "min": round(self.min, 2),
+                "max": round(self.max, 2),
+                "mean": round(self._sum / self.count, 2),
+                f"p{self.percentile:g}": round(self._quantile.value(), 2)}
+
+
+class SlidingMean(object):
+    """
+    mean of the readings of the last horizon [s], running sum:
+    O(1) amortized per reading, expired readings are dropped
+    """
+
+    def __init__(self, horizon: float):
+        self.horizon = horizon
+        self._readings = deque()
+        self._sum = 0.0
+
+    def __len__(self):
+        return len(self._readings)
+
+    def _expire(self, now: float):
+        while self._readings and now - self._readings[0][0] > self.horizon:
+            self._sum -= self._readings.popleft()[1]
+        if not self._readings:
+            self._sum = 0.0 # no rounding drift of the running sum
+
+    def append(self, ts: float, value: float):
+        self._readings.append((ts, value))
+        self._sum += value
+        self._expire(ts)
+
+    def mean(self, now: float = None):
+        """ mean of the readings within horizon before now, None: no readings """
+        if now is not None:
+            self._expire(now)
+        if not self._readings:
+            return None
+        return self._sum / len(self._readings)